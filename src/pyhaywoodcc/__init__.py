@@ -1,11 +1,29 @@
+from .cache import invalidate_reference_cache, reference_cache
+from .data import load_data
 from .ipeds import (
+    cohort_outcomes,
     credential_seekers,
     fall_credential_seekers,
     fall_enrollment,
+    ipeds_bundle,
     ipeds_cohort,
-    load_data,
+    iter_credential_seekers,
+    iter_term_enrollment,
+    term_calendar,
     term_enrollment,
 )
-from .utils import commas_to_mv, delim_to_mv, load_config, mv_to_commas, mv_to_delim
+from .terms import TermCalendar
+from .utils import (
+    as_of_snapshot,
+    commas_to_mv,
+    delim_to_mv,
+    duckdb_connection,
+    interval_join,
+    iter_delim_to_mv,
+    iter_mv_to_delim,
+    load_config,
+    mv_to_commas,
+    mv_to_delim,
+)
 
 __version__ = "0.2.2"
@@ -0,0 +1,502 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+import polars as pl
+import pyarrow.parquet as pq
+
+
+class ReferenceCache(object):
+    """
+    An in-process cache for small reference extracts such as Term_CU, COURSE_SECTIONS
+    and ACAD_PROGRAMS.
+
+    ttl (float)        Number of seconds an entry is kept before it is read again from
+                          the source. This defaults to one hour.
+    max_bytes (int)    Maximum estimated size of all cached frames. The least recently
+                          used entries are evicted first. This defaults to 256 MB.
+
+    Entries are keyed by the connection source and config plus the arguments passed
+    to get_data, so different databases or configurations never share entries.
+    """
+
+    def __init__(self, ttl: float = 3600, max_bytes: int = 256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, Tuple[float, int, pl.DataFrame]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[pl.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            stored, _, df = entry
+            if time.monotonic() - stored > self.ttl:
+                del self._entries[key]
+                return None
+
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            return df
+
+    def put(self, key: Tuple, df: pl.DataFrame) -> None:
+        size = df.estimated_size()
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), size, df)
+            self._entries.move_to_end(key)
+
+            # Evict least recently used entries until we fit
+            while sum(entry[1] for entry in self._entries.values()) > self.max_bytes:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, source: Optional[str] = None, file: Optional[str] = None):
+        """
+        Remove entries from the cache. With no arguments everything is removed,
+        otherwise only the entries for the given source and/or file.
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if (source is None or key[0] == source) and (
+                    file is None or key[3] == file
+                ):
+                    del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# The cache shared by all connections in this process
+reference_cache = ReferenceCache()
+
+
+def invalidate_reference_cache(
+    source: Optional[str] = None, file: Optional[str] = None
+) -> None:
+    """
+    Clear the reference data cache, either completely or for a source and/or file.
+    """
+    reference_cache.invalidate(source=source, file=file)
+
+
+def _config_key(config: Any) -> str:
+    # Configs are nested dicts; hash a stable rendering of them
+    rendered = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(rendered.encode("utf-8")).hexdigest()
+
+
+def reference_key(conn: Any, file: str, **kwargs) -> Tuple:
+    """
+    Build the cache key for a get_data call on a connection.
+    """
+    return (
+        conn.source,
+        conn.sourcepath,
+        _config_key(conn.config),
+        file,
+        _config_key(kwargs),
+    )
+
+
+def extract_cache_path(config: Any) -> Optional[str]:
+    """
+    Return the folder for the on-disk extract cache (informer.cache_path in config.yml),
+    or None if the cache is not enabled.
+    """
+    try:
+        cache_path = config["informer"]["cache_path"]
+    except (KeyError, TypeError):
+        return None
+
+    return cache_path or None
+
+
+# connectorx URI for the CCDW SQL Server, built from the same sql settings in config.yml
+#     the connection reads with. A user and password there are used when set, otherwise
+#     Windows authentication, as for the connection.
+def _sql_uri(config: Any) -> str:
+    sql = config["sql"]
+
+    if sql.get("user"):
+        user = quote(str(sql["user"]), safe="")
+        password = quote(str(sql.get("password") or ""), safe="")
+        return f"mssql://{user}:{password}@{sql['server']}/{sql['db']}"
+
+    return f"mssql://{sql['server']}/{sql['db']}?trusted_connection=true"
+
+
+def _source_table(file: str, schema: str, version: str) -> str:
+    # The latest version of a history table is exposed as the _Current view
+    if schema == "history" and version == "latest":
+        return f"[{schema}].[{file}_Current]"
+
+    return f"[{schema}].[{file}]"
+
+
+# Run a query on the source database. Only used for small aggregates such as watermarks.
+def _query_source(conn: Any, query: str) -> pl.DataFrame:
+    return pl.read_database_uri(query=query, uri=_sql_uri(conn.config))
+
+
+# Read from the source with the connection's own get_data and return a polars DataFrame.
+#     Used when an aggregate query cannot be run on the source.
+def _read_source(conn: Any, file: str, **kwargs) -> pl.DataFrame:
+    data = conn.get_data(file, **kwargs)
+
+    if isinstance(data, pl.LazyFrame):
+        return data.collect()
+
+    if isinstance(data, pl.DataFrame):
+        return data
+
+    return pl.from_pandas(data)
+
+
+def source_watermark(
+    conn: Any,
+    file: str,
+    schema: str = "history",
+    version: str = "latest",
+    cols: Any = None,
+) -> Optional[Dict[str, str]]:
+    """
+    Return the row count and maximum EffectiveDatetime of a source table, used to tell
+    whether a cached extract is still current. Returns None for sources other than
+    the CCDW database, whose extracts are never cached.
+
+    The watermark is a single-row COUNT_BIG/MAX query on the server. If that query fails,
+    one column of the table is read through conn.get_data instead: EffectiveDatetime for
+    history tables, or the first of cols for other tables.
+    """
+    if conn.source != "ccdw":
+        return None
+
+    table = _source_table(file, schema, version)
+
+    if schema == "history":
+        query = f"SELECT COUNT_BIG(*) AS Row_Count, MAX([EffectiveDatetime]) AS Max_EffectiveDatetime FROM {table}"
+    else:
+        # Tables outside of history have no EffectiveDatetime
+        query = f"SELECT COUNT_BIG(*) AS Row_Count FROM {table}"
+
+    try:
+        row = _query_source(conn, query).row(0, named=True)
+    except Exception as e:
+        warnings.warn(f"Unable to query {table} for changes, reading it instead: {e}")
+        row = _read_watermark(conn, file, schema, version, cols)
+
+    return {name: str(value) for name, value in row.items()}
+
+
+# The watermark of source_watermark, computed from one column read through get_data
+def _read_watermark(
+    conn: Any, file: str, schema: str, version: str, cols: Any
+) -> Dict[str, Any]:
+    if schema == "history":
+        df = _read_source(
+            conn,
+            file,
+            schema=schema,
+            version=version,
+            cols={"EffectiveDatetime": "EffectiveDatetime"},
+        )
+
+        return {
+            "Row_Count": df.height,
+            "Max_EffectiveDatetime": df.get_column("EffectiveDatetime").max(),
+        }
+
+    if isinstance(cols, dict):
+        cols = dict(list(cols.items())[:1])
+    elif cols:
+        cols = list(cols)[:1]
+
+    df = _read_source(conn, file, schema=schema, version=version, cols=cols)
+
+    return {"Row_Count": df.height}
+
+
+# Write a file through a uniquely named temporary file in the same folder and then move it
+#     into place, so a failed write never leaves a partial file and writers in other threads
+#     never share a temporary file
+def _write_atomic(fn: str, write: Callable[[str], None]) -> None:
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(fn) or ".",
+        prefix=f"{os.path.basename(fn)}.",
+        suffix=".tmp",
+        delete=False,
+    ) as f:
+        tmp_fn = f.name
+
+    try:
+        write(tmp_fn)
+        os.replace(tmp_fn, fn)
+    except BaseException:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
+
+
+def _write_json(fn: str, data: Any) -> None:
+    def write(tmp_fn: str):
+        with open(tmp_fn, "w") as f:
+            json.dump(data, f, default=str)
+
+    _write_atomic(fn, write)
+
+
+def get_cached_extract(
+    conn: Any, file: str, fetch: Callable[[], pl.LazyFrame], **kwargs
+) -> pl.LazyFrame:
+    """
+    Return an extract from the on-disk Parquet cache, calling fetch() to read it from
+    the source when there is no cached copy or the source has changed since it was stored.
+
+    conn               The connection the extract is read with
+    file (str)         The table passed to get_data
+    fetch (callable)   Reads the extract from the source as a polars LazyFrame
+    kwargs             The remaining get_data arguments (schema, version, cols, where).
+                          These are part of the cache key.
+
+    Entries are keyed by the source database, table and get_data arguments and are
+    invalidated when the row count or maximum EffectiveDatetime of the source table
+    changes. If the source cannot be checked, a cached copy is used as is. Caching
+    is only done when informer.cache_path is set in config.yml.
+    """
+    cache_path = extract_cache_path(conn.config)
+    if cache_path is None:
+        return fetch()
+
+    key = _config_key(
+        [conn.source, conn.config.get("sql", {}), file, kwargs],
+    )
+    data_fn = os.path.join(cache_path, f"{file}__{key}.parquet")
+    meta_fn = os.path.join(cache_path, f"{file}__{key}.json")
+    is_cached = os.path.isfile(data_fn) and os.path.isfile(meta_fn)
+
+    try:
+        watermark = source_watermark(
+            conn,
+            file,
+            schema=kwargs.get("schema", "history"),
+            version=kwargs.get("version", "latest"),
+            cols=kwargs.get("cols"),
+        )
+    except Exception as e:
+        if not is_cached:
+            warnings.warn(f"Unable to check {file} for changes, not caching: {e}")
+            return fetch()
+
+        warnings.warn(f"Unable to check {file} for changes, using cached copy: {e}")
+        return pl.scan_parquet(data_fn)
+
+    if watermark is None:
+        return fetch()
+
+    if is_cached:
+        with open(meta_fn, "r") as f:
+            if json.load(f).get("watermark") == watermark:
+                return pl.scan_parquet(data_fn)
+
+    df = fetch().collect()
+
+    # The data is written before its metadata, so a failed write never leaves an entry
+    #     that looks current
+    os.makedirs(cache_path, exist_ok=True)
+    _write_atomic(data_fn, df.write_parquet)
+    _write_json(meta_fn, {"file": file, "args": kwargs, "watermark": watermark})
+
+    return pl.scan_parquet(data_fn)
+
+
+def csv_sidecar(csv_fn: str) -> Optional[str]:
+    """
+    Return the path of a Parquet copy of a CSV file that is kept next to it, building it
+    first if it is missing or the CSV has changed since it was built.
+
+    csv_fn (str)       The CSV file
+
+    All columns are stored as strings, the same as reading the CSV with no type inference.
+    The modification time and size of the CSV are stored in the Parquet metadata, and the
+    copy is rebuilt whenever either changes. Returns None if the copy cannot be written,
+    such as when the folder is read-only.
+    """
+    sidecar_fn = f"{csv_fn}.parquet"
+
+    stat = os.stat(csv_fn)
+    source = json.dumps({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}).encode()
+
+    if os.path.isfile(sidecar_fn):
+        try:
+            metadata = pq.read_schema(sidecar_fn).metadata or {}
+        except Exception:
+            metadata = {}
+
+        if metadata.get(b"pyhaywoodcc.source") == source:
+            return sidecar_fn
+
+    try:
+        table = pl.read_csv(csv_fn, infer_schema_length=0).to_arrow()
+        table = table.replace_schema_metadata({b"pyhaywoodcc.source": source})
+
+        _write_atomic(sidecar_fn, lambda tmp_fn: pq.write_table(table, tmp_fn))
+    except OSError as e:
+        warnings.warn(f"Unable to write {sidecar_fn}, reading the CSV file: {e}")
+        return None
+
+    return sidecar_fn
+
+
+def term_watermarks(
+    conn: Any,
+    file: str,
+    term_column: str,
+    term_ids: List[str],
+    schema: str = "history",
+    version: str = "history",
+) -> Optional[Dict[str, Dict[str, str]]]:
+    """
+    Return the row count and maximum EffectiveDatetime of a source table for each term,
+    used to tell whether stored results for a term are still current. Terms without
+    any rows are left out. Returns None for sources other than the CCDW database.
+
+    The counts are grouped by term on the server, so one row comes back per term. If that
+    query fails, the term and EffectiveDatetime columns are read through conn.get_data
+    and grouped here instead.
+    """
+    if conn.source != "ccdw":
+        return None
+
+    if not term_ids:
+        return {}
+
+    table = _source_table(file, schema, version)
+    term_list = ",".join(f"'{term_id}'" for term_id in term_ids)
+
+    try:
+        df = _query_source(
+            conn,
+            f"""
+                SELECT [{term_column}] AS Term_ID,
+                       COUNT_BIG(*) AS Row_Count,
+                       MAX([EffectiveDatetime]) AS Max_EffectiveDatetime
+                  FROM {table}
+                 WHERE [{term_column}] IN ({term_list})
+                 GROUP BY [{term_column}]
+            """,
+        )
+    except Exception as e:
+        warnings.warn(f"Unable to query {table} for changes, reading it instead: {e}")
+        df = (
+            _read_source(
+                conn,
+                file,
+                schema=schema,
+                version=version,
+                cols={term_column: "Term_ID", "EffectiveDatetime": "EffectiveDatetime"},
+                where=f"[{term_column}] IN [{term_list}]",
+            )
+            .group_by("Term_ID")
+            .agg(
+                pl.len().alias("Row_Count"),
+                pl.col("EffectiveDatetime").max().alias("Max_EffectiveDatetime"),
+            )
+        )
+
+    return {
+        row["Term_ID"]: {
+            "Row_Count": str(row["Row_Count"]),
+            "Max_EffectiveDatetime": str(row["Max_EffectiveDatetime"]),
+        }
+        for row in df.iter_rows(named=True)
+    }
+
+
+def get_incremental_slices(
+    conn: Any,
+    name: str,
+    term_ids: List[str],
+    watermarks: Optional[Dict[str, Any]],
+    compute: Callable[[List[str]], pl.LazyFrame],
+    open_terms: Optional[Set[str]] = None,
+    dtypes: Optional[Dict[str, Any]] = None,
+) -> pl.LazyFrame:
+    """
+    Return per-term results, reusing the slices stored by earlier runs and computing only
+    the terms that are open or have changed.
+
+    conn               The connection the results are computed with
+    name (str)         Name of the result, used as the folder under informer.cache_path
+    term_ids (list)    The terms to return
+    watermarks (dict)  The current watermark of each term. A stored slice is reused only if
+                          its watermark matches. If None, every term is recomputed.
+    compute (callable) Builds the result for a list of terms as a LazyFrame with a Term_ID column
+    open_terms (set)   Terms that can still change and are always recomputed
+    dtypes (dict)      Columns to cast every slice to, so slices stored when the Enum
+                          categories were different can still be concatenated
+
+    Recomputed slices are stored for the next run, one Parquet file per term.
+    """
+    cache_path = extract_cache_path(conn.config)
+    if cache_path is None:
+        raise ValueError(
+            "Incremental results require informer.cache_path to be set in config.yml."
+        )
+
+    if open_terms is None:
+        open_terms = set()
+
+    folder = os.path.join(cache_path, name, _config_key(conn.config.get("sql", {})))
+
+    frames = []
+    stale = []
+    for term_id in term_ids:
+        data_fn = os.path.join(folder, f"{term_id}.parquet")
+        meta_fn = os.path.join(folder, f"{term_id}.json")
+
+        if (
+            watermarks is not None
+            and term_id not in open_terms
+            and os.path.isfile(data_fn)
+            and os.path.isfile(meta_fn)
+        ):
+            with open(meta_fn, "r") as f:
+                if json.load(f).get("watermark") == watermarks.get(term_id):
+                    frames.append(pl.scan_parquet(data_fn))
+                    continue
+
+        stale.append(term_id)
+
+    if stale or not frames:
+        df = compute(stale).collect()
+
+        os.makedirs(folder, exist_ok=True)
+        for term_id in stale:
+            data_fn = os.path.join(folder, f"{term_id}.parquet")
+            meta_fn = os.path.join(folder, f"{term_id}.json")
+
+            watermark = None if watermarks is None else watermarks.get(term_id)
+            _write_atomic(
+                data_fn, df.filter(pl.col("Term_ID") == term_id).write_parquet
+            )
+            _write_json(meta_fn, {"term": term_id, "watermark": watermark})
+
+        frames.append(df.lazy())
+
+    if dtypes:
+        frames = [frame.cast(dtypes) for frame in frames]
+
+    return pl.concat(frames, how="vertical")
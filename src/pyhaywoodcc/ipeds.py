@@ -1,13 +1,26 @@
 import os.path
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 
 # import sys
-from typing import List, Union
+from typing import Dict, Iterator, List, Union
 
-import duckdb as ddb
 import pandas as pd
 import polars as pl
 from pycolleague import ColleagueConnection
 
+from .cache import (
+    csv_sidecar,
+    get_cached_extract,
+    get_incremental_slices,
+    reference_cache,
+    reference_key,
+    term_watermarks,
+)
+from .terms import TermCalendar
+from .utils import as_of_snapshot, duckdb_connection, interval_join
+
 # class IPEDS(object):
 
 #     conn: ColleagueConnection
@@ -22,6 +35,232 @@ class LocalConnection(ColleagueConnection):
     pass
 
 
+# Create a local connection with the same settings as the caller's connection
+def _local_connection(conn: ColleagueConnection, lazy: bool) -> LocalConnection:
+    return LocalConnection(
+        source=conn.source,
+        sourcepath=conn.sourcepath,
+        format="polars",
+        lazy=lazy,
+        config=conn.config,
+        read_only=conn.read_only,
+    )
+
+
+# Integer columns returned by the reports, with the dtype callers have always received.
+#     They are narrowed while the reports are built and widened again on the way out.
+_OUTPUT_DTYPES = {
+    "Term_Reporting_Year": pl.Int64,
+    "Term_Offset": pl.Int64,
+    "Credits": pl.Int32,
+    "Credential_Seeker": pl.Int32,
+}
+
+
+# Convert a polars result to the format and laziness of the caller's connection.
+#     Enum and Categorical columns go back to strings so the compact dtypes used while
+#     the report is built do not leak into the output.
+def _format_output(
+    df: Union[pl.DataFrame, pl.LazyFrame], conn: ColleagueConnection
+) -> Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]:
+    casts = {
+        column: _OUTPUT_DTYPES.get(column, pl.Utf8)
+        for column, dtype in df.schema.items()
+        if column in _OUTPUT_DTYPES or dtype == pl.Enum or dtype == pl.Categorical
+    }
+    if casts:
+        df = df.with_columns(
+            [pl.col(column).cast(dtype) for column, dtype in casts.items()]
+        )
+
+    if conn.df_format == "pandas":
+        if isinstance(df, pl.LazyFrame):
+            df = df.collect()
+
+        return df.to_pandas()
+
+    if conn.lazy:
+        return df.lazy()
+
+    if isinstance(df, pl.LazyFrame):
+        return df.collect()
+
+    return df
+
+
+# Return the result of get_data as a LazyFrame, whatever the local connection returned
+def _fetch_lazy(lconn: LocalConnection, file: str, **kwargs) -> pl.LazyFrame:
+    data = lconn.get_data(file, **kwargs)
+
+    if isinstance(data, pl.LazyFrame):
+        return data
+
+    if isinstance(data, pd.DataFrame):
+        return pl.from_pandas(data).lazy()
+
+    return pl.DataFrame(data).lazy()
+
+
+# Same as _fetch_lazy, but when informer.cache_path is set in the config, the extract is
+# served from the on-disk cache.
+def _get_lazy(lconn: LocalConnection, file: str, **kwargs) -> pl.LazyFrame:
+    return get_cached_extract(
+        lconn, file, lambda: _fetch_lazy(lconn, file, **kwargs), **kwargs
+    )
+
+
+# Same as _get_lazy, but for small reference extracts that are kept in the in-process cache
+def _get_reference(lconn: LocalConnection, file: str, **kwargs) -> pl.LazyFrame:
+    key = reference_key(lconn, file, **kwargs)
+
+    data = reference_cache.get(key)
+    if data is None:
+        data = _get_lazy(lconn, file, **kwargs).collect()
+        reference_cache.put(key, data)
+
+    return data.lazy()
+
+
+# Code columns with only a few distinct values are kept as categoricals from extraction
+#     through to the output to cut the memory used by joins and unique
+_CODE_DTYPES = {
+    "Semester": pl.Categorical,
+    "Course_Status": pl.Categorical,
+    "Course_Level": pl.Categorical,
+    "Grade_Code": pl.Categorical,
+    "Delivery_Method": pl.Categorical,
+    "Student_Type": pl.Categorical,
+}
+
+
+# Cast the code columns of a frame, plus any other dtypes given, to compact dtypes.
+# Values missing from an Enum become null.
+def _compact(
+    frame: Union[pl.DataFrame, pl.LazyFrame],
+    dtypes: Union[Dict[str, pl.PolarsDataType], None] = None,
+) -> Union[pl.DataFrame, pl.LazyFrame]:
+    casts = {**_CODE_DTYPES, **(dtypes or {})}
+
+    return frame.with_columns(
+        [
+            pl.col(column).cast(dtype, strict=False)
+            for column, dtype in casts.items()
+            if column in frame.columns
+        ]
+    )
+
+
+# Build an Enum of the values of a column. Join keys use Enums rather than Categoricals
+#     so frames from different extracts can be joined without a global string cache.
+def _enum_of(frame: Union[pl.DataFrame, pl.LazyFrame], column: str) -> pl.Enum:
+    if isinstance(frame, pl.LazyFrame):
+        frame = frame.select(column).collect()
+
+    return pl.Enum(frame.get_column(column).drop_nulls().unique().sort().to_list())
+
+
+# Source extracts read by the reports. For each extract, the source column of every
+#     output column a report step can use.
+_EXTRACTS = {
+    "COURSE_SECTIONS": {
+        "COURSE.SECTIONS.ID": "Course_Section_ID",
+        "SEC.TERM": "Term_ID",
+        "SEC.LOCATION": "Section_Location",
+        "X.SEC.DELIVERY.METHOD": "Delivery_Method",
+        "X.SEC.DELIVERY.MODE": "Delivery_Mode",
+        # "X.SEC.DELIVERY.NCIH.FLAG" : "Delivery_NCIH_Flag",
+        # "X.SEC.DELIVERY/MODIFIER" : "Delivery_Modifier",
+    },
+    "STUDENT_ACAD_CRED": {
+        "STC.PERSON.ID": "Person_ID",
+        "STC.TERM": "Term_ID",
+        "STUDENT.ACAD.CRED.ID": "Course_ID",
+        "STC.CRED": "Credit",
+        "STC.COURSE.LEVEL": "Course_Level",
+        "STC.VERIFIED.GRADE": "Grade_Code",
+        "STC.SECTION.NO": "Course_Section",
+        "STC.COURSE.SECTION": "Course_Section_ID",
+        "STC.STATUS": "Course_Status",
+        "EffectiveDatetime": "EffectiveDatetime",
+    },
+    "ACAD_PROGRAMS": {
+        "ACAD.PROGRAMS.ID": "Program",
+    },
+    "STUDENT_PROGRAMS__STPR_DATES": {
+        "STPR.STUDENT": "Person_ID",
+        "STPR.ACAD.PROGRAM": "Program",
+        "STPR.START.DATE": "Program_Start_Date",
+        "STPR.END.DATE": "Program_End_Date",
+        # "EffectiveDatetime": "EffectiveDatetime",
+    },
+    "STUDENTS__STU_TYPES": {
+        "STUDENTS.ID": "Person_ID",
+        "STU.TYPES": "Student_Type",
+        "STU.TYPE.DATES": "Student_Type_Date",
+        "STU.TYPE.END.DATES": "Student_Type_End_Date",
+    },
+}
+
+# The steps of each report and the extract columns each step reads
+_REPORT_STEPS = {
+    "term_enrollment": {
+        "enrollment": {
+            "STUDENT_ACAD_CRED": [
+                "Person_ID",
+                "Term_ID",
+                "Course_ID",
+                "Credit",
+                "Course_Level",
+                "Grade_Code",
+                "Course_Section_ID",
+                "Course_Status",
+                "EffectiveDatetime",
+            ],
+            "COURSE_SECTIONS": ["Course_Section_ID", "Term_ID", "Delivery_Method"],
+        },
+    },
+    "credential_seekers": {
+        "programs": {
+            "ACAD_PROGRAMS": ["Program"],
+            "STUDENT_PROGRAMS__STPR_DATES": [
+                "Person_ID",
+                "Program",
+                "Program_Start_Date",
+                "Program_End_Date",
+            ],
+        },
+        # Only needed to exclude high school students
+        "hs_students": {
+            "STUDENTS__STU_TYPES": [
+                "Person_ID",
+                "Student_Type",
+                "Student_Type_Date",
+                "Student_Type_End_Date",
+            ],
+        },
+    },
+}
+
+
+# Plan the extracts for the given steps of a report before anything is read. Returns the
+#     get_data cols for each extract the steps need; extracts and columns used by none
+#     of the steps are left out.
+def _plan(report: str, steps: List[str]) -> Dict[str, Dict[str, str]]:
+    needed: Dict[str, set] = {}
+    for step in steps:
+        for file, columns in _REPORT_STEPS[report][step].items():
+            needed.setdefault(file, set()).update(columns)
+
+    return {
+        file: {
+            source: column
+            for source, column in _EXTRACTS[file].items()
+            if column in needed[file]
+        }
+        for file in needed
+    }
+
+
 # Get the terms and report_terms data frames
 def get_terms(
     lconn: LocalConnection,
@@ -29,31 +268,29 @@ def get_terms(
     report_semesters: Union[str, List[str], None] = None,
 ) -> List[Union[Union[pl.DataFrame, pl.LazyFrame], Union[pl.DataFrame, pl.LazyFrame]]]:
     terms = (
-        pl.DataFrame(
-            lconn.get_data(
-                "Term_CU",
-                schema="dw_dim",
-                cols={
-                    "Term_ID": "Term_ID",
-                    "Term_Index": "Term_Index",
-                    "Semester": "Term_Name",
-                    "Term_Abbreviation": "Semester",
-                    "Term_Start_Date": "Term_Start_Date",
-                    "Term_Census_Date": "Term_Census_Date",
-                    "Term_End_Date": "Term_End_Date",
-                    "Reporting_Year_FSS": "Term_Reporting_Year",
-                    "Reporting_Academic_Year_FSS": "Academic_Year",
-                },
-            )
-        )
-        .cast(
+        _get_reference(
+            lconn,
+            "Term_CU",
+            schema="dw_dim",
+            cols={
+                "Term_ID": "Term_ID",
+                "Term_Index": "Term_Index",
+                "Semester": "Term_Name",
+                "Term_Abbreviation": "Semester",
+                "Term_Start_Date": "Term_Start_Date",
+                "Term_Census_Date": "Term_Census_Date",
+                "Term_End_Date": "Term_End_Date",
+                "Reporting_Year_FSS": "Term_Reporting_Year",
+                "Reporting_Academic_Year_FSS": "Academic_Year",
+            },
+        ).cast(
             {
                 # Convert dates to polars datetime type
                 "Term_Start_Date": pl.Date,
                 "Term_Census_Date": pl.Date,
                 "Term_End_Date": pl.Date,
-                "Term_Reporting_Year": pl.Int64,
-                "Term_Index": pl.Int64,
+                "Term_Reporting_Year": pl.Int16,
+                "Term_Index": pl.Int16,
             }
         )
         # subtract 1 from Term_Reporting_Year to reflect the fall term year
@@ -62,6 +299,9 @@ def get_terms(
         )
     )
 
+    # Term_ID is the key of most joins, so make it an Enum of all the known terms
+    terms = _compact(terms, {"Term_ID": _enum_of(terms, "Term_ID")})
+
     if report_years is None:
         reporting_terms = terms
     else:
@@ -83,314 +323,479 @@ def get_terms(
             pl.col("Semester").is_in(report_semesters)
         )
 
-    # reporting_terms = reporting_terms.collect()
+    # Terms are built lazily; only materialize them when the local connection is eager
+    if not lconn.lazy:
+        terms, reporting_terms = pl.collect_all([terms, reporting_terms])
 
     return [terms, reporting_terms]
 
 
-#' Return enrollment for specified term as of the IPEDS reporting date of October 15
-#'
-#' All data comes from CCDW_HIST SQL Server database
+#' Return the term calendar used to look up terms by ID or date
 #'
-#' @param report_years The ending year of the academic year of the data
-#' @param report_semesters Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
 #' @export
-#' @importFrom ccdwr getColleagueData
-#' @importFrom magrittr %>%
-#' @importFrom dplyr select collect mutate filter inner_join left_join
-#'     group_by summarise distinct anti_join ungroup coalesce
-#' @importFrom stringr str_c
 #'
-def term_enrollment(
-    conn: ColleagueConnection,
-    report_years: Union[int, List[int], None] = None,
-    report_semesters: Union[str, List[str], None] = None,
-) -> Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]:
+def term_calendar(conn: ColleagueConnection) -> TermCalendar:
     """
-    Return enrollment for specified term as of the IPEDS reporting date of October 15
+    Return the term calendar for the connection
 
     Args:
         conn: A ColleagueConnection object
-        report_years: The list of years to include in the data. If unspecified, all years are returned.
-        report_semesters: Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
 
     Returns:
-        A pandas or polars dataframe of the data
+        A TermCalendar of all the terms in Term_CU. Term_CU is read through the reference
+        cache, so repeated calls on the same connection do not go back to the database.
     """
-    source: str = conn.source
-    df_format: str = conn.df_format
-    lazy: bool = conn.lazy
+    terms, _ = get_terms(_local_connection(conn, lazy=False))
 
-    # lconn = local_conn_type(source=source, df_format=df_format, lazy=lazy)
-    lconn = LocalConnection(
-        source=conn.source,
-        sourcepath=conn.sourcepath,
-        format="polars",
-        # lazy=True,
-        lazy=False,
-        config=conn.config,
-        read_only=conn.read_only,
+    return TermCalendar(terms)
+
+
+# Return the sorted list of Term_IDs in a terms frame
+def _term_ids(terms: Union[pl.DataFrame, pl.LazyFrame]) -> List[str]:
+    if isinstance(terms, pl.LazyFrame):
+        terms = terms.select("Term_ID").collect()
+
+    return terms.get_column("Term_ID").unique().sort().to_list()
+
+
+# Return the IDs of the terms in the report years, or None for all years. Cohorts are
+#     limited by report year only, whatever semesters the rest of a report uses.
+def _year_term_ids(
+    terms: Union[pl.DataFrame, pl.LazyFrame],
+    report_years: Union[int, List[int], None],
+) -> Union[List[str], None]:
+    if report_years is None:
+        return None
+
+    if isinstance(report_years, int):
+        report_years = [report_years]
+
+    return _term_ids(terms.filter(pl.col("Term_Reporting_Year").is_in(report_years)))
+
+
+# Split the reporting terms into one frame per reporting year (by="year") or per term (by="term")
+def _report_slices(
+    reporting_terms: pl.DataFrame, by: str = "year"
+) -> List[pl.DataFrame]:
+    if by == "year":
+        column = "Term_Reporting_Year"
+    elif by == "term":
+        column = "Term_ID"
+    else:
+        raise ValueError(f"by must be 'year' or 'term', not '{by}'")
+
+    return [
+        reporting_terms.filter(pl.col(column) == value)
+        for value in reporting_terms.get_column(column).unique().sort().to_list()
+    ]
+
+
+# Build a where clause condition limiting a term column to the given terms
+def _term_condition(
+    column: str, terms: Union[pl.DataFrame, pl.LazyFrame, List[str]]
+) -> str:
+    term_ids = terms if isinstance(terms, list) else _term_ids(terms)
+
+    return _in_condition(column, term_ids)
+
+
+# Build a where clause condition limiting a column to the given values
+def _in_condition(column: str, values: List[str]) -> str:
+    if not values:
+        # No values requested, so make sure no rows come back from the source
+        return "1 = 0"
+
+    value_list = ",".join(f"'{value}'" for value in values)
+
+    return f"[{column}] IN [{value_list}]"
+
+
+# Number of connections used at once to read large extracts (sql.extract_workers in config.yml)
+def _extract_workers(config) -> int:
+    try:
+        return max(int(config["sql"]["extract_workers"]), 1)
+    except (KeyError, TypeError, ValueError):
+        return 4
+
+
+# Split the given terms into at most n where clause conditions on a term column.
+# Terms are dealt out in turn so each partition gets a mix of large and small terms.
+def _term_partitions(
+    column: str, terms: Union[pl.DataFrame, pl.LazyFrame], n: int
+) -> List[str]:
+    term_ids = _term_ids(terms)
+
+    if not term_ids:
+        return [_term_condition(column, term_ids)]
+
+    return [
+        _term_condition(column, term_ids[i::n]) for i in range(min(n, len(term_ids)))
+    ]
+
+
+# Number of digits in person IDs (sql.id_width in config.yml)
+def _id_width(config) -> int:
+    try:
+        return max(int(config["sql"]["id_width"]), 1)
+    except (KeyError, TypeError, ValueError):
+        return 7
+
+
+# Split a zero-padded numeric ID column such as a person ID into n ranges of equal width,
+# plus a last partition for the IDs outside all the ranges (including missing IDs)
+def _range_partitions(column: str, n: int, width: int = 7) -> List[str]:
+    if n < 2:
+        return [""]
+
+    bounds = [str(10**width * i // n).zfill(width) for i in range(n + 1)]
+    ranges = [
+        f"[{column}] >= '{lower}' AND [{column}] < '{upper}'"
+        for lower, upper in zip(bounds[:-2], bounds[1:-1])
+    ] + [f"[{column}] >= '{bounds[-2]}' AND [{column}] <= '{'9' * width}'"]
+
+    rest = " OR ".join(f"({condition})" for condition in ranges)
+
+    return ranges + [f"[{column}] IS NULL OR NOT ({rest})"]
+
+
+# Read an extract in partitions, each on its own connection in its own thread, and
+# concatenate the parts. Each partition is a where clause condition added to where.
+# Together the partitions are one extract, so they are cached as a single entry with
+# a single check of the source for changes.
+def _get_partitioned(
+    lconn: LocalConnection,
+    file: str,
+    partitions: List[str],
+    where: str = "",
+    **kwargs,
+) -> pl.LazyFrame:
+    def partition_where(partition: str) -> str:
+        if not where.strip():
+            return partition
+        if not partition:
+            return where
+        return f"{where}\nAND ({partition})"
+
+    if len(partitions) == 1:
+        return _get_lazy(lconn, file, where=partition_where(partitions[0]), **kwargs)
+
+    def read(partition: str) -> pl.DataFrame:
+        return _fetch_lazy(
+            _local_connection(lconn, lazy=lconn.lazy),
+            file,
+            where=partition_where(partition),
+            **kwargs,
+        ).collect()
+
+    def fetch() -> pl.LazyFrame:
+        workers = min(len(partitions), _extract_workers(lconn.config))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(read, partitions))
+
+        return pl.concat(parts, how="vertical_relaxed", rechunk=True).lazy()
+
+    return get_cached_extract(
+        lconn,
+        file,
+        fetch,
+        where=partition_where(" OR ".join(f"({p})" for p in partitions)),
+        **kwargs,
     )
 
-    terms, reporting_terms = get_terms(
-        lconn, report_years=report_years, report_semesters=report_semesters
+
+# Build the lazy plan for term_enrollment for the given reporting terms.
+# When filter_terms is True, only the reporting terms are read from the source.
+def _term_enrollment(
+    lconn: LocalConnection,
+    terms: pl.LazyFrame,
+    reporting_terms: pl.LazyFrame,
+    filter_terms: bool = True,
+) -> pl.LazyFrame:
+    # Only the reporting terms are kept at the end, so only pull those terms from the source.
+    #     Every step below works within a single term, so this does not change the result.
+    if not filter_terms:
+        sec_term_where = ""
+    else:
+        sec_term_where = _term_condition("SEC.TERM", reporting_terms)
+
+    # STUDENT_ACAD_CRED is the largest extract, so read it in partitions of terms over
+    #     several connections at once. Courses in terms missing from Term_CU are dropped
+    #     below anyway.
+    sac_partitions = _term_partitions(
+        "STC.TERM",
+        reporting_terms if filter_terms else terms,
+        _extract_workers(lconn.config),
     )
 
-    # Need to get section location for distance learning courses
+    # Term_ID is an Enum of the known terms; courses in other terms become null and
+    #     are dropped below
+    term_dtype = terms.schema["Term_ID"]
+    calendar = TermCalendar(terms)
+
+    plan = _plan("term_enrollment", ["enrollment"])
+
+    # Need to get section delivery method for distance learning courses
     # Right now, just take most recent. Probably need to do this the same way as SAC below.
-    course_sections = pl.DataFrame(
-        lconn.get_data(
-            "COURSE_SECTIONS",
-            cols={
-                "COURSE.SECTIONS.ID": "Course_Section_ID",
-                "SEC.TERM": "Term_ID",
-                "SEC.LOCATION": "Section_Location",
-                "X.SEC.DELIVERY.METHOD": "Delivery_Method",
-                "X.SEC.DELIVERY.MODE": "Delivery_Mode",
-                # "X.SEC.DELIVERY.NCIH.FLAG" : "Delivery_NCIH_Flag",
-                # "X.SEC.DELIVERY/MODIFIER" : "Delivery_Modifier",
-            },
-        )
-    )
+    course_sections = _get_reference(
+        lconn,
+        "COURSE_SECTIONS",
+        cols=plan["COURSE_SECTIONS"],
+        where=sec_term_where,
+    ).pipe(_compact, {"Term_ID": term_dtype})
 
     student_acad_cred = (
-        pl.DataFrame(
-            lconn.get_data(
-                "STUDENT_ACAD_CRED",
-                version="history",
-                cols={
-                    "STC.PERSON.ID": "Person_ID",
-                    "STC.TERM": "Term_ID",
-                    "STUDENT.ACAD.CRED.ID": "Course_ID",
-                    "STC.CRED": "Credit",
-                    "STC.COURSE.LEVEL": "Course_Level",
-                    "STC.VERIFIED.GRADE": "Grade_Code",
-                    "STC.SECTION.NO": "Course_Section",
-                    "STC.COURSE.SECTION": "Course_Section_ID",
-                    "STC.STATUS": "Course_Status",
-                    "EffectiveDatetime": "EffectiveDatetime",
-                },
-                where="""
-                    [STC.CRED] > 0
-                    AND [STC.ACAD.LEVEL] == 'CU'
-                    /*AND [STC.PERSON.ID] IN ['0078937','1151394']
-                    AND [STC.TERM] IN ('2022FA')*/
-                """,
-                # debug="query",
-            )
+        _get_partitioned(
+            lconn,
+            "STUDENT_ACAD_CRED",
+            sac_partitions,
+            version="history",
+            cols=plan["STUDENT_ACAD_CRED"],
+            where="""
+                [STC.CRED] > 0
+                AND [STC.ACAD.LEVEL] == 'CU'
+                /*AND [STC.PERSON.ID] IN ['0078937','1151394']*/
+            """,
+            # debug="query",
         )
         .cast(
             {
                 # Convert EffectiveDatetime to polars datetime type
                 "EffectiveDatetime": pl.Datetime,
                 # Convert Credit to numeric value
-                "Credit": pl.Int32,
+                "Credit": pl.Int16,
             }
         )
-        .join(
-            pl.DataFrame(
-                terms.select(
-                    ["Term_ID", "Term_Reporting_Year", "Semester", "Term_Census_Date"]
-                )
-            ),
-            on="Term_ID",
-            how="inner",
-        )
-        .with_columns(
-            # Set Keep_FA to True when Semester is FA and EffectiveDatetime is on or before October 15 of the Term_Reporting_Year
-            # Set Keep_NF to True when Semester is not FA
-            # Use datetime with time set to 23:59:59 to make sure we get all the courses for the day
-            # Oct15dt=pl.datetime(
-            #     year=pl.col("Term_Reporting_Year"),
-            #     month=pl.lit("10"),
-            #     day=pl.lit("15"),
-            #     hour=pl.lit("23"),
-            #     minute=pl.lit("59"),
-            #     second=pl.lit("59"),
-            # ),
-            # Use date, which sets the time to 00:00:00, which will not select any courses on Oct 15
-            Oct15=pl.date(
-                year=pl.col("Term_Reporting_Year"), month=pl.lit("10"), day=pl.lit("15")
-            ),
-        )
+        .pipe(_compact, {"Term_ID": term_dtype})
+        # Courses in terms missing from Term_CU have a null Term_ID after the cast above.
+        #     Drop them and look up the term columns in the calendar instead of a join.
+        .drop_nulls("Term_ID")
         .with_columns(
-            Keep_FA=(
-                (pl.col("Semester") == "FA")
-                & (pl.col("EffectiveDatetime") <= pl.col("Oct15"))
-            ),
-            Keep_NF=(pl.col("Semester") != "FA"),
+            calendar.column("Term_Reporting_Year"),
+            calendar.column("Semester"),
         )
-        .filter(pl.col("Keep_FA") | pl.col("Keep_NF"))
-        .drop(["Oct15", "Keep_FA", "Keep_NF"])
         .join(
             course_sections,
             on=["Term_ID", "Course_Section_ID"],
             how="left",
+            coalesce=True,
         )
     )
 
     #
-    # Get most recent effective date for each person for each term for each course
-    #
-    sac_max_effdt = (
-        student_acad_cred.group_by(["Person_ID", "Term_ID", "Course_ID"]).agg(
-            pl.max("EffectiveDatetime").alias("EffectiveDatetime")
-        )
-        # .collect()
-    )
-
-    #
-    # Now get the course data for the latest courses.
+    # Get the most recent version of each course for each person for each term.
+    # FA terms are taken as of October 15 of the Term_Reporting_Year. Other terms have no cutoff.
     # Use Status of A,N for FA since we want only enrolled courses at the cutoff date
     #     (This will be taken care of later as we need the W credits to determine load)
     # Use Status A,N,W for SP,SU since these were all the courses enrolled in at census
     #
     sac_most_recent_all = (
-        student_acad_cred.join(
-            sac_max_effdt,
-            on=["Person_ID", "Term_ID", "Course_ID", "EffectiveDatetime"],
-            how="inner",
+        as_of_snapshot(
+            student_acad_cred,
+            keys=["Person_ID", "Term_ID", "Course_ID"],
+            ts_col="EffectiveDatetime",
+            # Use datetime with time set to 23:59:59 to make sure we get all the courses for the day
+            # cutoff=pl.when(pl.col("Semester") == "FA").then(
+            #     pl.datetime(
+            #         year=pl.col("Term_Reporting_Year"),
+            #         month=pl.lit("10"),
+            #         day=pl.lit("15"),
+            #         hour=pl.lit("23"),
+            #         minute=pl.lit("59"),
+            #         second=pl.lit("59"),
+            #     )
+            # ),
+            # Use date, which sets the time to 00:00:00, which will not select any courses on Oct 15
+            cutoff=pl.when(pl.col("Semester") == "FA").then(
+                pl.date(
+                    year=pl.col("Term_Reporting_Year"),
+                    month=pl.lit("10"),
+                    day=pl.lit("15"),
+                )
+            ),
         )
         .filter(pl.col("Course_Status").is_in(["A", "N", "W"]))
         .drop(["EffectiveDatetime"])
-        .unique()
-        .drop(["Course_ID"])
-        # .collect()
-    )
-
-    #
-    # Get list of students who are taking at least 1 non-developmental/audited course
-    #
-    sac_most_recent_non_dev_ids = (
-        sac_most_recent_all.filter(
-            pl.col("Course_Level").fill_null("ZZZ") != "DEV",
-            pl.col("Grade_Code").fill_null("X") != "9",
-        )
-        .select(["Person_ID", "Term_ID"])
-        .unique()
-        # .collect()
-    )
-
-    #
-    # Get list of students who are taking at least 1 distance course
-    #
-    sac_most_recent_1_distance_ids = (
-        sac_most_recent_all.join(
-            sac_most_recent_non_dev_ids,
-            on=["Person_ID", "Term_ID"],
-            how="inner",
-        )
-        .filter(
-            pl.col("Delivery_Method") == "IN",
-            pl.col("Grade_Code").fill_null("X") != "9",
+        # Only the columns the plan needs are extracted, so dedupe on the course key
+        #     rather than on whatever columns happen to be left
+        .unique(
+            subset=["Person_ID", "Term_ID", "Course_ID"],
+            keep="first",
+            maintain_order=True,
         )
-        .select(["Person_ID", "Term_ID"])
-        .unique()
+        .drop(["Course_ID"])
         # .collect()
     )
 
     #
-    # Get list of students who are taking at least 1 regular course
+    # Now create a summary table to calculate load by term.
+    # All the per-student flags are computed in the same pass as the credit sum:
+    #     Non_Dev   taking at least 1 non-developmental/audited course (only these students are kept)
+    #     Distance  taking at least 1 distance course
+    #     F2F       taking at least 1 regular course
+    #     Has_W     taking at least 1 W course
+    #     Has_AN    taking at least 1 A,N course
+    # Students with W courses but no A,N courses have completely withdrawn at the end or by Oct 15
     #
-    sac_most_recent_f2f_ids = (
-        sac_most_recent_all.filter(
-            pl.col("Delivery_Method") != "IN",
-            pl.col("Grade_Code").fill_null("X") != "9",
-        )
-        .select(["Person_ID", "Term_ID"])
-        .unique()
-        # .collect()
-    )
-
-    sac_most_recent_all_distance_ids = sac_most_recent_1_distance_ids.join(
-        sac_most_recent_f2f_ids,
-        on=["Person_ID", "Term_ID"],
-        how="anti",
-    ).with_columns(Distance_Courses=pl.lit("All"))
-
-    sac_most_recent_distance_ids = sac_most_recent_1_distance_ids.join(
-        sac_most_recent_all_distance_ids,
-        on=["Person_ID", "Term_ID"],
-        how="left",
-    ).with_columns(pl.col("Distance_Courses").fill_null(pl.lit("At least 1")))
-
-    # Determine which students have completely withdrawn at the end or by Oct 15
-    sac_most_recent_all_withdraws = (
-        sac_most_recent_all.filter(pl.col("Course_Status") == "W")
-        .join(
-            sac_most_recent_all.filter(pl.col("Course_Status").is_in(["A", "N"])),
-            on=["Person_ID", "Term_ID"],
-            how="anti",
-        )
-        .select(["Person_ID", "Term_ID"])
-        .unique()
-        .with_columns(Enrollment_Status=pl.lit("Withdrawn"))
-        # .collect()
-    )
+    not_audit = (pl.col("Grade_Code") != "9").fill_null(True)
 
-    #
-    # Now create a summary table to calculate load by term
-    #
     sac_load_by_term = (
-        sac_most_recent_all.join(
-            sac_most_recent_non_dev_ids,
-            on=["Person_ID", "Term_ID"],
-            how="inner",
+        sac_most_recent_all.group_by(
+            ["Person_ID", "Term_ID", "Term_Reporting_Year", "Semester"]
         )
-        .join(
-            pl.DataFrame(terms.select(["Term_ID", "Term_Reporting_Year", "Semester"])),
-            on=["Term_ID", "Term_Reporting_Year", "Semester"],
-            how="inner",
+        .agg(
+            pl.sum("Credit").cast(pl.Int16).alias("Credits"),
+            Non_Dev=(
+                (pl.col("Course_Level") != "DEV").fill_null(True) & not_audit
+            ).any(),
+            Distance=(
+                (pl.col("Delivery_Method") == "IN").fill_null(False) & not_audit
+            ).any(),
+            F2F=(
+                (pl.col("Delivery_Method") != "IN").fill_null(False) & not_audit
+            ).any(),
+            Has_W=(pl.col("Course_Status") == "W").any(),
+            Has_AN=pl.col("Course_Status").is_in(["A", "N"]).any(),
         )
-        .group_by(["Person_ID", "Term_ID", "Term_Reporting_Year", "Semester"])
-        .agg(pl.sum("Credit").alias("Credits"))
+        .filter(pl.col("Non_Dev"))
         .with_columns(
             Status=pl.when(pl.col("Credits") >= 12)
             .then(pl.lit("FT"))
-            .otherwise(pl.lit("PT"))
+            .otherwise(pl.lit("PT")),
+            Distance_Courses=pl.when(pl.col("Distance") & ~pl.col("F2F"))
+            .then(pl.lit("All"))
+            .when(pl.col("Distance"))
+            .then(pl.lit("At least 1"))
+            .otherwise(pl.lit("None")),
+            Enrollment_Status=pl.when(pl.col("Has_W") & ~pl.col("Has_AN"))
+            .then(pl.lit("Withdrawn"))
+            .otherwise(pl.lit("Enrolled")),
         )
-        .join(sac_most_recent_distance_ids, on=["Person_ID", "Term_ID"], how="left")
-        .join(sac_most_recent_all_withdraws, on=["Person_ID", "Term_ID"], how="left")
-        .with_columns(
-            pl.col("Distance_Courses").fill_null(pl.lit("None")),
-            pl.col("Enrollment_Status").fill_null(pl.lit("Enrolled")),
+        .cast(
+            {
+                "Status": pl.Enum(["FT", "PT"]),
+                "Distance_Courses": pl.Enum(["All", "At least 1", "None"]),
+                "Enrollment_Status": pl.Enum(["Enrolled", "Withdrawn"]),
+            }
         )
+        .drop(["Non_Dev", "Distance", "F2F", "Has_W", "Has_AN"])
     )
 
     #
     # Take term load table and reduce to the reporting terms
     #
     sac_load_by_term = sac_load_by_term.join(
-        pl.DataFrame(reporting_terms.select(["Term_ID", "Term_Reporting_Year"])),
+        reporting_terms.select(["Term_ID", "Term_Reporting_Year"]),
         on=["Term_ID", "Term_Reporting_Year"],
         how="inner",
     )
 
-    if conn.df_format == "pandas":
-        # We need to return a pandas dataframe
+    return sac_load_by_term
+
 
-        # If the local connection is lazy, we need to collect the data
-        #     since pandas dataframes are not lazy
-        if lconn.lazy:
-            sac_load_by_term = sac_load_by_term.collect()
+# Build term_enrollment from the per-term slices stored by earlier runs, recomputing only
+# the terms that have not ended yet or whose source rows have changed since they were stored.
+def _incremental_term_enrollment(
+    lconn: LocalConnection,
+    terms: pl.LazyFrame,
+    reporting_terms: pl.LazyFrame,
+) -> pl.LazyFrame:
+    reporting = reporting_terms.select(["Term_ID", "Term_End_Date"]).collect()
+    term_ids = reporting.get_column("Term_ID").to_list()
+
+    # Terms that have not ended yet can still change, so they are always recomputed
+    open_terms = set(
+        reporting.filter(pl.col("Term_End_Date") >= date.today())
+        .get_column("Term_ID")
+        .to_list()
+    )
 
-        # Now convert to pandas dataframe
-        sac_load_by_term = sac_load_by_term.to_pandas()
+    # A term has changed if its course or section rows have changed
+    try:
+        sac_watermarks = term_watermarks(
+            lconn, "STUDENT_ACAD_CRED", "STC.TERM", term_ids, version="history"
+        )
+        sec_watermarks = term_watermarks(
+            lconn, "COURSE_SECTIONS", "SEC.TERM", term_ids, version="latest"
+        )
+    except Exception as e:
+        warnings.warn(f"Unable to check terms for changes, recomputing all terms: {e}")
+        sac_watermarks = sec_watermarks = None
 
-    else:  # df_format is polars
-        # Since the return format is polars, we just need to check the lazy flag
+    if sac_watermarks is None or sec_watermarks is None:
+        watermarks = None
+    else:
+        watermarks = {
+            term_id: [sac_watermarks.get(term_id), sec_watermarks.get(term_id)]
+            for term_id in term_ids
+        }
 
-        # If the return connection is lazy...
-        if conn.lazy:
-            # ...and the local connection is not lazy, we need to convert to a lazy dataframe
-            if not lconn.lazy:
-                sac_load_by_term = sac_load_by_term.lazy()
-        else:  # The return connection is not lazy
-            # ...and the local connection is lazy, we need to collect the data
-            if lconn.lazy:
-                sac_load_by_term = sac_load_by_term.collect()
+    return get_incremental_slices(
+        lconn,
+        "term_enrollment",
+        term_ids,
+        watermarks,
+        lambda stale_ids: _term_enrollment(
+            lconn,
+            terms,
+            reporting_terms.filter(pl.col("Term_ID").is_in(stale_ids)),
+        ),
+        open_terms=open_terms,
+        dtypes={"Term_ID": terms.schema["Term_ID"]},
+    )
 
-    return sac_load_by_term
+
+#' Return enrollment for specified term as of the IPEDS reporting date of October 15
+#'
+#' All data comes from CCDW_HIST SQL Server database
+#'
+#' @param report_years The ending year of the academic year of the data
+#' @param report_semesters Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+#' @export
+#' @importFrom ccdwr getColleagueData
+#' @importFrom magrittr %>%
+#' @importFrom dplyr select collect mutate filter inner_join left_join
+#'     group_by summarise distinct anti_join ungroup coalesce
+#' @importFrom stringr str_c
+#'
+def term_enrollment(
+    conn: ColleagueConnection,
+    report_years: Union[int, List[int], None] = None,
+    report_semesters: Union[str, List[str], None] = None,
+    incremental: bool = False,
+) -> Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]:
+    """
+    Return enrollment for specified term as of the IPEDS reporting date of October 15
+
+    Args:
+        conn: A ColleagueConnection object
+        report_years: The list of years to include in the data. If unspecified, all years are returned.
+        report_semesters: Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+        incremental: Reuse the per-term results stored under informer.cache_path by earlier runs and only
+            recompute terms that are still open or whose data has changed. Default is to compute all terms.
+
+    Returns:
+        A pandas or polars dataframe of the data
+    """
+    # Build the whole pipeline as a single lazy plan so Polars can push filters and
+    #     column selection down and drop intermediate frames. The plan is only
+    #     collected at the end if the caller wants an eager result.
+    lconn = _local_connection(conn, lazy=True)
+
+    terms, reporting_terms = get_terms(
+        lconn, report_years=report_years, report_semesters=report_semesters
+    )
+
+    if incremental:
+        sac_load_by_term = _incremental_term_enrollment(lconn, terms, reporting_terms)
+    else:
+        sac_load_by_term = _term_enrollment(
+            lconn,
+            terms,
+            reporting_terms,
+            filter_terms=(report_years is not None or report_semesters is not None),
+        )
+
+    return _format_output(sac_load_by_term, conn)
 
 
 #' A special function to call term_enrollment for just a fall term
@@ -406,111 +811,183 @@ def fall_enrollment(
     return term_enrollment(conn, report_years, "FA")
 
 
-#' Return a data frame of students who are curriculum credential seekers (seeking an Associate's, Diploma, or Certificate)
-#'
-#' All data comes from CCDW_HIST SQL Server database
+#' Return enrollment one reporting year (or term) at a time
 #'
-#' @param report_years The year or a list of years of the fall term for the data. If unspecified, all years are returned.
+#' @param report_years The ending year of the academic year of the data
 #' @param report_semesters Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
-#' @param exclude_hs Should function exclude high school students from being included as credential seekers. Default is to include high school students.
+#' @param by Either "year" or "term"
 #' @export
-#' @importFrom ccdwr getColleagueData
-#' @importFrom magrittr %<>% %>%
-#' @importFrom dplyr select collect mutate filter inner_join anti_join
-#'     full_join left_join distinct case_when coalesce
 #'
-def credential_seekers(
+def iter_term_enrollment(
     conn: ColleagueConnection,
     report_years: Union[int, List[int], None] = None,
     report_semesters: Union[str, List[str], None] = None,
-    exclude_hs: bool = False,
-):
-    lconn = LocalConnection(
-        source=conn.source,
-        sourcepath=conn.sourcepath,
-        format="polars",
-        # lazy=True,
-        lazy=False,
-        config=conn.config,
-        read_only=conn.read_only,
-    )
+    by: str = "year",
+) -> Iterator[Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]]:
+    """
+    Yield enrollment one reporting year (or term) at a time
+
+    Args:
+        conn: A ColleagueConnection object
+        report_years: The list of years to include in the data. If unspecified, all years are returned.
+        report_semesters: Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+        by: Either "year" to yield one reporting year at a time or "term" to yield one term at a time.
+            Default is "year".
+
+    Returns:
+        A generator of pandas or polars dataframes, one for each reporting year or term, in order.
+        Only one slice is computed at a time, so peak memory is that of a single slice.
+    """
+    lconn = _local_connection(conn, lazy=False)
 
     terms, reporting_terms = get_terms(
         lconn, report_years=report_years, report_semesters=report_semesters
     )
 
-    # Get only CU programs from ACAD_PROGRAMS
-    acad_programs = pl.DataFrame(
-        lconn.get_data(
-            "ACAD_PROGRAMS",
-            cols={"ACAD.PROGRAMS.ID": "Program"},
-            where="[ACPG.ACAD.LEVEL] == 'CU'",
+    for slice_terms in _report_slices(reporting_terms, by=by):
+        yield _format_output(
+            _term_enrollment(
+                _local_connection(conn, lazy=True), terms.lazy(), slice_terms.lazy()
+            ).collect(),
+            conn,
         )
-    )
 
+
+# Return the high school students (by student type) in each of the reporting terms
+def _hs_students(
+    lconn: LocalConnection,
+    reporting_terms: pl.DataFrame,
+    cols: Dict[str, str],
+    term_dtype: pl.PolarsDataType,
+) -> pl.DataFrame:
     # Get earliest start date from the reporting terms as YYYY-MM-DD
     report_term_start_date = (
         reporting_terms.select("Term_Census_Date").min().rows()[0][0]
     ).strftime("%Y-%m-%d")
 
-    hs_students__all = pl.DataFrame(
-        lconn.get_data(
+    hs_students__all = (
+        _get_lazy(
+            lconn,
             "STUDENTS__STU_TYPES",
             version="history",
-            cols={
-                "STUDENTS.ID": "Person_ID",
-                "STU.TYPES": "Student_Type",
-                "STU.TYPE.DATES": "Student_Type_Date",
-                "STU.TYPE.END.DATES": "Student_Type_End_Date",
-            },
+            cols=cols,
             where=f"""
                 [STU.TYPES] IN ['HUSK','DUAL','CCPP','ECOL']
                 AND [STU.TYPE.END.DATES] >= '{report_term_start_date}' 
             """,
             # debug="query",
         )
-    ).cast(
-        {
-            "Student_Type_Date": pl.Date,
-            "Student_Type_End_Date": pl.Date,
-        }
+        .cast(
+            {
+                "Student_Type_Date": pl.Date,
+                "Student_Type_End_Date": pl.Date,
+            }
+        )
+        .collect()
     )
 
-    hs_students = ddb.sql(
-        """
-        SELECT DISTINCT 
-               hs.Person_ID
-             , hs.Student_Type
-             , rt.Term_ID
-        FROM hs_students__all hs
-        CROSS JOIN (SELECT Term_ID, Term_Census_Date FROM reporting_terms) rt
-        WHERE hs.Student_Type_Date <= rt.Term_Census_Date
-        AND hs.Student_Type_End_Date >= rt.Term_Census_Date
-        ORDER BY hs.Person_ID, rt.Term_ID
+    # Match student types to the reporting terms whose census date falls within them.
+    #     DuckDB runs the two inequality conditions as a range join rather than a cross join.
+    duckdb_conn = duckdb_connection(lconn.config)
+    try:
+        duckdb_conn.register("hs_students__all", hs_students__all.to_arrow())
+        duckdb_conn.register(
+            "reporting_terms",
+            reporting_terms.select(["Term_ID", "Term_Census_Date"]).to_arrow(),
+        )
+
+        hs_students = pl.from_arrow(duckdb_conn.sql("""
+                SELECT DISTINCT 
+                       hs.Person_ID
+                     , hs.Student_Type
+                     , rt.Term_ID
+                FROM hs_students__all hs
+                JOIN reporting_terms rt
+                  ON hs.Student_Type_Date <= rt.Term_Census_Date
+                 AND hs.Student_Type_End_Date >= rt.Term_Census_Date
+                ORDER BY hs.Person_ID, rt.Term_ID
+                """).arrow())
+    finally:
+        duckdb_conn.close()
+
+    # DuckDB returns plain strings, so match the columns to the compact dtypes again
+    return _compact(hs_students, {"Term_ID": term_dtype})
+
+
+# Build credential_seekers for the given reporting terms
+def _credential_seekers(
+    lconn: LocalConnection,
+    terms: pl.DataFrame,
+    reporting_terms: pl.DataFrame,
+    exclude_hs: bool = False,
+) -> pl.DataFrame:
+    # High school students are only looked up when they are to be excluded
+    plan = _plan(
+        "credential_seekers", ["programs"] + (["hs_students"] if exclude_hs else [])
+    )
+
+    # Get only CU programs from ACAD_PROGRAMS
+    acad_programs = _get_reference(
+        lconn,
+        "ACAD_PROGRAMS",
+        cols=plan["ACAD_PROGRAMS"],
+        where="[ACPG.ACAD.LEVEL] == 'CU'",
+    ).collect()
+
+    # Program and Term_ID are join keys, so keep them as Enums of the known values
+    program_dtype = _enum_of(acad_programs, "Program")
+    acad_programs = acad_programs.cast({"Program": program_dtype})
+    term_dtype = terms.schema["Term_ID"]
+
+    if "STUDENTS__STU_TYPES" in plan:
+        hs_students = _hs_students(
+            lconn, reporting_terms, plan["STUDENTS__STU_TYPES"], term_dtype
+        )
+
+    # Only programs that are active on some reporting term census date can match a term,
+    #     and only CU credential programs are kept, so filter both in the source query
+    first_census, last_census = reporting_terms.select(
+        first=pl.min("Term_Census_Date"), last=pl.max("Term_Census_Date")
+    ).row(0)
+    credential_programs = (
+        acad_programs.filter(pl.col("Program").cast(pl.Utf8).str.contains("^(A|D|C)"))
+        .get_column("Program")
+        .cast(pl.Utf8)
+        .to_list()
+    )
+
+    if first_census is None:
+        program_where = "1 = 0"
+    else:
+        program_where = f"""
+            {_in_condition("STPR.ACAD.PROGRAM", credential_programs)}
+            AND [STPR.START.DATE] <= '{last_census.strftime("%Y-%m-%d")}'
+            AND ([STPR.END.DATE] >= '{first_census.strftime("%Y-%m-%d")}' OR [STPR.END.DATE] IS NULL)
         """
-    ).pl()
 
     #
     # Get program dates (this is a multi-valued field that needs to be joined with full table).
     #
     student_programs__dates = (
-        pl.DataFrame(
-            lconn.get_data(
-                "STUDENT_PROGRAMS__STPR_DATES",
-                version="history",
-                cols={
-                    "STPR.STUDENT": "Person_ID",
-                    "STPR.ACAD.PROGRAM": "Program",
-                    "STPR.START.DATE": "Program_Start_Date",
-                    "STPR.END.DATE": "Program_End_Date",
-                    # "EffectiveDatetime": "EffectiveDatetime",
-                },
-            )
+        _get_partitioned(
+            lconn,
+            "STUDENT_PROGRAMS__STPR_DATES",
+            _range_partitions(
+                "STPR.STUDENT",
+                _extract_workers(lconn.config),
+                _id_width(lconn.config),
+            ),
+            version="history",
+            cols=plan["STUDENT_PROGRAMS__STPR_DATES"],
+            where=program_where,
         )
+        .collect()
         .with_columns(
             Program_Start_Date=pl.col("Program_Start_Date").cast(pl.Date),
             Program_End_Date=pl.col("Program_End_Date").cast(pl.Date),
             # EffectiveDatetime=pl.col("EffectiveDatetime").cast(pl.Date),
+            # Programs that are not CU become null and are dropped by the join below
+            Program=pl.col("Program").cast(program_dtype, strict=False),
         )
         .join(
             acad_programs,
@@ -520,7 +997,11 @@ def credential_seekers(
         .with_columns(
             Program_End_Date=pl.col("Program_End_Date").fill_null(pl.date(9999, 12, 31))
         )
-        .unique()
+        .unique(
+            subset=["Person_ID", "Program", "Program_Start_Date", "Program_End_Date"],
+            keep="first",
+            maintain_order=True,
+        )
     )
 
     # if exclude_hs:
@@ -552,39 +1033,21 @@ def credential_seekers(
         # Identify credential seekers.
         .with_columns(
             Credential_Seeker=pl.when(
-                pl.col("Program").str.contains("^(A|D|C)"),
+                pl.col("Program").cast(pl.Utf8).str.contains("^(A|D|C)"),
             )
-            .then(pl.lit(1))
-            .otherwise(pl.lit(0))
-        )
-        # Cross join with terms to get all the terms they were enrolled in this credential program.
-        .join(
-            pl.DataFrame(
-                terms.select(
-                    ["Term_ID", "Term_Start_Date", "Term_Census_Date", "Term_End_Date"]
-                )
-            ),
-            how="cross",
-        )
-        .filter(
-            pl.col("Program_Start_Date") <= pl.col("Term_Census_Date"),
-            pl.col("Program_End_Date") >= pl.col("Term_Census_Date"),
-            pl.col("Credential_Seeker") > 0,
-        )
-        .join(
-            pl.DataFrame(reporting_terms.select(["Term_ID"])),
-            on=["Term_ID"],
-            how="inner",
-        )
-        .join(
-            hs_students,
-            on=["Person_ID", "Term_ID"],
-            how="left",
+            .then(pl.lit(1, dtype=pl.Int8))
+            .otherwise(pl.lit(0, dtype=pl.Int8))
         )
-        .with_columns(
-            hs_student=(pl.col("Student_Type").fill_null("") != ""),
+        .filter(pl.col("Credential_Seeker") > 0)
+        # Join with the reporting terms whose census date falls within the program dates
+        #     to get all the terms they were enrolled in this credential program.
+        .pipe(
+            interval_join,
+            pl.DataFrame(reporting_terms.select(["Term_ID", "Term_Census_Date"])),
+            start="Program_Start_Date",
+            end="Program_End_Date",
+            on="Term_Census_Date",
         )
-        .filter((exclude_hs & ~pl.col("hs_student")) | (exclude_hs is False))
         .select(
             [
                 "Person_ID",
@@ -592,35 +1055,50 @@ def credential_seekers(
                 "Credential_Seeker",
             ]
         )
-        .unique()
+        .unique(subset=["Person_ID", "Term_ID"], keep="first", maintain_order=True)
         # .collect()
     )
 
-    if conn.df_format == "pandas":
-        # We need to return a pandas dataframe
+    if exclude_hs:
+        credential_seeking = credential_seeking.join(
+            hs_students,
+            on=["Person_ID", "Term_ID"],
+            how="anti",
+        )
 
-        # If the local connection is lazy, we need to collect the data
-        #     since pandas dataframes are not lazy
-        if lconn.lazy:
-            credential_seeking = credential_seeking.collect()
+    return credential_seeking
 
-        # Now convert to pandas dataframe
-        credential_seeking = credential_seeking.to_pandas()
 
-    else:  # df_format is polars
-        # Since the return format is polars, we just need to check the lazy flag
+#' Return a data frame of students who are curriculum credential seekers (seeking an Associate's, Diploma, or Certificate)
+#'
+#' All data comes from CCDW_HIST SQL Server database
+#'
+#' @param report_years The year or a list of years of the fall term for the data. If unspecified, all years are returned.
+#' @param report_semesters Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+#' @param exclude_hs Should function exclude high school students from being included as credential seekers. Default is to include high school students.
+#' @export
+#' @importFrom ccdwr getColleagueData
+#' @importFrom magrittr %<>% %>%
+#' @importFrom dplyr select collect mutate filter inner_join anti_join
+#'     full_join left_join distinct case_when coalesce
+#'
+def credential_seekers(
+    conn: ColleagueConnection,
+    report_years: Union[int, List[int], None] = None,
+    report_semesters: Union[str, List[str], None] = None,
+    exclude_hs: bool = False,
+):
+    lconn = _local_connection(conn, lazy=False)
 
-        # If the return connection is lazy...
-        if conn.lazy:
-            # ...and the local connection is not lazy, we need to convert to a lazy dataframe
-            if not lconn.lazy:
-                credential_seeking = credential_seeking.lazy()
-        else:  # The return connection is not lazy
-            # ...and the local connection is lazy, we need to collect the data
-            if lconn.lazy:
-                credential_seeking = credential_seeking.collect()
+    terms, reporting_terms = get_terms(
+        lconn, report_years=report_years, report_semesters=report_semesters
+    )
 
-    return credential_seeking
+    credential_seeking = _credential_seekers(
+        lconn, terms, reporting_terms, exclude_hs=exclude_hs
+    )
+
+    return _format_output(credential_seeking, conn)
 
 
 #' A special function to call credential_seekers for just a fall term
@@ -641,53 +1119,66 @@ def fall_credential_seekers(
     )
 
 
-#' Return a data from of the IPEDS cohort data.
+#' Return credential seekers one reporting year (or term) at a time
 #'
-#' Return a data from of the IPEDS cohort data. Data will come either from the file ipeds_cohorts.csv or
-#' from the CCDW_HIST SQL Server database.
-#'
-#' @param report_years The year of the fall term for the data
-#' @param cohorts Which cohorts to include in data frame. FT = Full-time First-time, PT = Part-time First-time,
-#'                TF = Full-time Transfer, TP = Part-time Transfer,
-#'                RF = Full-time Returning, RP = Part-time Returning
-#' @param cohort_types Which cohort fields to include in data frame. Default is Cohort only. Choose from
-#'                      "Cohort", "OM_Cohort", "Term_Cohort".
-#' @param use Which dataset should be used for cohorts from Colleague
-#'            ipeds_cohorts Use the local.ipeds_cohorts table
-#'            STUDENT_TERMS Use the history.STUDENT_TERMS_Current view
-#' @param useonly Use the database cohort found in the table specified in the
-#'     `use` parameter only. Default is FALSE which means combine data from
-#'     the database table with the file ipeds_cohorts.csv.
-#' @param ipeds_path The path where ipeds_cohort.csv file is located.
+#' @param report_years The year or a list of years of the fall term for the data. If unspecified, all years are returned.
+#' @param report_semesters Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+#' @param exclude_hs Should function exclude high school students from being included as credential seekers. Default is to include high school students.
+#' @param by Either "year" or "term"
 #' @export
-#' @importFrom ccdwr getColleagueData
-#' @importFrom purrr has_element
-#' @importFrom dplyr filter select collect bind_rows distinct mutate
-#' @importFrom stringr str_c
-#' @importFrom readr read_csv cols col_character
 #'
-def ipeds_cohort(
+def iter_credential_seekers(
     conn: ColleagueConnection,
     report_years: Union[int, List[int], None] = None,
+    report_semesters: Union[str, List[str], None] = None,
+    exclude_hs: bool = False,
+    by: str = "year",
+) -> Iterator[Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]]:
+    """
+    Yield credential seekers one reporting year (or term) at a time
+
+    Args:
+        conn: A ColleagueConnection object
+        report_years: The list of years to include in the data. If unspecified, all years are returned.
+        report_semesters: Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+        exclude_hs: Exclude high school students from the credential seekers. Default is to include them.
+        by: Either "year" to yield one reporting year at a time or "term" to yield one term at a time.
+            Default is "year".
+
+    Returns:
+        A generator of pandas or polars dataframes, one for each reporting year or term, in order.
+        Only one slice is computed at a time, so peak memory is that of a single slice.
+    """
+    lconn = _local_connection(conn, lazy=False)
+
+    terms, reporting_terms = get_terms(
+        lconn, report_years=report_years, report_semesters=report_semesters
+    )
+
+    for slice_terms in _report_slices(reporting_terms, by=by):
+        yield _format_output(
+            _credential_seekers(lconn, terms, slice_terms, exclude_hs=exclude_hs),
+            conn,
+        )
+
+
+# Build ipeds_cohort from the database and, unless useonly is True, the ipeds_cohorts.csv file
+def _ipeds_cohort(
+    lconn: LocalConnection,
+    report_term_ids: Union[List[str], None] = None,
     cohorts: Union[str, List[str]] = ["FT", "PT", "TF", "TP", "RF", "RP"],
-    cohort_types: Union[
-        str, List[str]
-    ] = "Cohort",  # Also allows "OM_Cohort","Term_Cohort"
+    cohort_types: Union[str, List[str]] = "Cohort",
     use: str = "ipeds_cohorts",
     ipeds_path: str = "",
     useonly: bool = True,
-) -> Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]:
-    ipeds_cohort: Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]
+    prefer: str = "file",
+) -> pl.DataFrame:
+    ipeds_cohort: pl.DataFrame
 
-    lconn = LocalConnection(
-        source=conn.source,
-        sourcepath=conn.sourcepath,
-        format="polars",
-        # lazy=True,
-        lazy=False,
-        config=conn.config,
-        read_only=conn.read_only,
-    )
+    if prefer not in ["file", "database"]:
+        raise ValueError(
+            "Invalid value for prefer parameter. Must be 'file' or 'database'."
+        )
 
     # Make sure cohort_types is a list
     if isinstance(cohort_types, str):
@@ -714,36 +1205,88 @@ def ipeds_cohort(
         ipeds_path = "."  # Default to current directory
         # print warning message about using current directory
 
-    # Check to see if ipeds_cohorts.csv file exists in ipeds_path
-    if os.path.isfile(os.path.join(ipeds_path, "ipeds_cohorts.csv")):
-        # Read the ipeds_cohorts.csv file
-        ipeds_cohort_FILE_COHORTS = (
-            pl.read_csv(
-                os.path.join(ipeds_path, "ipeds_cohorts.csv"),
-                dtypes="str",  # {"Cohort": "string", "OM_Cohort": "string", "Term_Cohort": "string"},
+    # Limit the cohorts to the terms of the report years, both in the database query
+    #     and when scanning the file. The caller has already looked up the terms.
+    cohort_conditions = []
+    if report_term_ids is not None:
+        cohort_conditions.append(_in_condition("Term_ID", report_term_ids))
+
+    # Only keep the requested cohorts from the database. Rows without a Cohort are still
+    #     needed when other cohort types are requested.
+    if "Cohort" in cohort_types:
+        cohort_condition = _in_condition("Cohort", cohorts)
+        if cohort_types != ["Cohort"]:
+            cohort_condition = f"{cohort_condition} OR [Cohort] IS NULL"
+        cohort_conditions.append(f"({cohort_condition})")
+
+    cohort_where = " AND ".join(cohort_conditions)
+
+    ipeds_cohort_FILE_COHORTS = None
+
+    # The file is only read if its cohorts are going to be used
+    cohorts_fn = os.path.join(ipeds_path, "ipeds_cohorts.csv")
+    if useonly is False and os.path.isfile(cohorts_fn):
+        # Scan the Parquet copy of ipeds_cohorts.csv (rebuilt whenever the file changes) so only
+        #     the needed columns are read and the filters are applied while it is read.
+        #     All the columns are read as strings.
+        sidecar_fn = csv_sidecar(cohorts_fn)
+        if sidecar_fn is None:
+            ipeds_cohort_FILE_COHORTS = pl.scan_csv(cohorts_fn, infer_schema_length=0)
+        else:
+            ipeds_cohort_FILE_COHORTS = pl.scan_parquet(sidecar_fn)
+
+        ipeds_cohort_FILE_COHORTS = ipeds_cohort_FILE_COHORTS.filter(
+            pl.col("Cohort").is_in(cohorts)
+        )
+
+        if report_term_ids is not None:
+            ipeds_cohort_FILE_COHORTS = ipeds_cohort_FILE_COHORTS.filter(
+                pl.col("Term_ID").is_in(report_term_ids)
             )
-            .filter(pl.col("Cohort").is_in(cohorts))
-            .select(["Person_ID", "Term_ID", "Cohort"])
+
+        # Line the file up with the database columns, adding any cohort types the file lacks
+        file_columns = ipeds_cohort_FILE_COHORTS.columns
+        ipeds_cohort_FILE_COHORTS = ipeds_cohort_FILE_COHORTS.select(
+            ["Person_ID", "Term_ID"]
+            + [
+                (
+                    pl.col(column)
+                    if column in file_columns
+                    else pl.lit(None, dtype=pl.Utf8).alias(column)
+                )
+                for column in cohort_types
+            ]
         )
-    else:
-        # If the file does not exist, return an empty data frame
-        ipeds_cohort_FILE_COHORTS = pl.DataFrame()
 
     if use == "STUDENT_TERMS":
         # If use is STUDENT_TERMS, return the STUDENT_TERMS_Current view
+        #     The view only has the Cohort type, so any other cohort types are null.
         ipeds_cohort = (
             lconn.get_data(
                 "STUDENT_TERMS",
                 cols={
                     "STTR.STUDENT": "Person_ID",
+                    "STTR.TERM": "Term_ID",
                     "STTR.FED.COHORT.GROUP": "Cohort",
                 },
+                where=(
+                    ""
+                    if report_term_ids is None
+                    else _in_condition("STTR.TERM", report_term_ids)
+                ),
             )
             .filter(pl.col("Cohort").is_in(cohorts))
-            .unique()
-            .select(["Person_ID", "Term_ID", "Cohort"])
-            .with_columns(
-                Term_ID=f'{pl.col("Cohort").str.slice(1,4)}FA',
+            .unique(subset=["Person_ID", "Term_ID"], keep="first", maintain_order=True)
+            .select(
+                ["Person_ID", "Term_ID"]
+                + [
+                    (
+                        pl.col(column)
+                        if column == "Cohort"
+                        else pl.lit(None, dtype=pl.Utf8).alias(column)
+                    )
+                    for column in cohort_types
+                ]
             )
         )
 
@@ -755,44 +1298,356 @@ def ipeds_cohort(
         ipeds_cohort = lconn.get_data(
             "ipeds_cohorts",
             schema="local",
+            where=cohort_where,
         ).rename({"ID": "Person_ID"})
 
         # Select the Person_ID, Term_ID, Cohort columns as well as any columns named in cohort_types
         ipeds_cohort = ipeds_cohort.select(["Person_ID", "Term_ID"] + cohort_types)
 
-        if cohort_types == ["Cohort"]:
-            # filter out rows where cohort is null
-            ipeds_cohort = ipeds_cohort.filter(pl.col("Cohort").is_not_null())
+    # if useonly is False, combine the data from the database with the data from the file.
+    #     A student's cohort for a term comes from the preferred source when both have it.
+    if ipeds_cohort_FILE_COHORTS is not None:
+        keys = ["Person_ID", "Term_ID"]
 
-    # if useonly is False, combine the data from the database with the data from the file
-    if useonly is False:
-        ipeds_cohort = ipeds_cohort_FILE_COHORTS.vstack(ipeds_cohort)
+        # Each source can list a student more than once for a term, so keep the first row
+        #     of each before the sources are merged
+        database_cohorts = ipeds_cohort.lazy().unique(
+            subset=keys, keep="first", maintain_order=True
+        )
+        ipeds_cohort_FILE_COHORTS = ipeds_cohort_FILE_COHORTS.unique(
+            subset=keys, keep="first", maintain_order=True
+        )
 
-    if conn.df_format == "pandas":
-        # We need to return a pandas dataframe
+        if prefer == "file":
+            database_cohorts = database_cohorts.join(
+                ipeds_cohort_FILE_COHORTS, on=keys, how="anti"
+            )
+        else:
+            ipeds_cohort_FILE_COHORTS = ipeds_cohort_FILE_COHORTS.join(
+                database_cohorts, on=keys, how="anti"
+            )
 
-        # If the local connection is lazy, we need to collect the data
-        #     since pandas dataframes are not lazy
-        if lconn.lazy:
-            ipeds_cohort = ipeds_cohort.collect()
+        ipeds_cohort = pl.concat(
+            [ipeds_cohort_FILE_COHORTS, database_cohorts], how="vertical_relaxed"
+        ).collect()
 
-        # Now convert to pandas dataframe
-        ipeds_cohort = ipeds_cohort.to_pandas()
+    return ipeds_cohort
 
-    else:  # df_format is polars
-        # Since the return format is polars, we just need to check the lazy flag
 
-        # If the return connection is lazy...
-        if conn.lazy:
-            # ...and the local connection is not lazy, we need to convert to a lazy dataframe
-            if not lconn.lazy:
-                ipeds_cohort = ipeds_cohort.lazy()
-        else:  # The return connection is not lazy
-            # ...and the local connection is lazy, we need to collect the data
-            if lconn.lazy:
-                ipeds_cohort = ipeds_cohort.collect()
+#' Return a data from of the IPEDS cohort data.
+#'
+#' Return a data from of the IPEDS cohort data. Data will come either from the file ipeds_cohorts.csv or
+#' from the CCDW_HIST SQL Server database.
+#'
+#' @param report_years The year of the fall term for the data
+#' @param cohorts Which cohorts to include in data frame. FT = Full-time First-time, PT = Part-time First-time,
+#'                TF = Full-time Transfer, TP = Part-time Transfer,
+#'                RF = Full-time Returning, RP = Part-time Returning
+#' @param cohort_types Which cohort fields to include in data frame. Default is Cohort only. Choose from
+#'                      "Cohort", "OM_Cohort", "Term_Cohort".
+#' @param use Which dataset should be used for cohorts from Colleague
+#'            ipeds_cohorts Use the local.ipeds_cohorts table
+#'            STUDENT_TERMS Use the history.STUDENT_TERMS_Current view
+#' @param useonly Use the database cohort found in the table specified in the
+#'     `use` parameter only. Default is FALSE which means combine data from
+#'     the database table with the file ipeds_cohorts.csv.
+#' @param ipeds_path The path where ipeds_cohort.csv file is located.
+#' @param prefer When combining the database with the file, which one ("file" or "database")
+#'     a student's cohort for a term is taken from when both have it. Default is "file".
+#' @export
+#' @importFrom ccdwr getColleagueData
+#' @importFrom purrr has_element
+#' @importFrom dplyr filter select collect bind_rows distinct mutate
+#' @importFrom stringr str_c
+#' @importFrom readr read_csv cols col_character
+#'
+def ipeds_cohort(
+    conn: ColleagueConnection,
+    report_years: Union[int, List[int], None] = None,
+    cohorts: Union[str, List[str]] = ["FT", "PT", "TF", "TP", "RF", "RP"],
+    cohort_types: Union[
+        str, List[str]
+    ] = "Cohort",  # Also allows "OM_Cohort","Term_Cohort"
+    use: str = "ipeds_cohorts",
+    ipeds_path: str = "",
+    useonly: bool = True,
+    prefer: str = "file",
+) -> Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]:
+    lconn = _local_connection(conn, lazy=False)
 
-    return ipeds_cohort
+    if report_years is None:
+        report_term_ids = None
+    else:
+        terms, _ = get_terms(lconn)
+        report_term_ids = _year_term_ids(terms, report_years)
+
+    ipeds_cohort = _ipeds_cohort(
+        lconn,
+        report_term_ids=report_term_ids,
+        cohorts=cohorts,
+        cohort_types=cohort_types,
+        use=use,
+        ipeds_path=ipeds_path,
+        useonly=useonly,
+        prefer=prefer,
+    )
+
+    return _format_output(ipeds_cohort, conn)
+
+
+#' Return the enrollment of each cohort in each of the terms after its cohort term
+#'
+#' All data comes from CCDW_HIST SQL Server database
+#'
+#' @param cohort_years The year or a list of years of the cohort fall terms
+#' @param horizon_terms The number of terms after the cohort term to follow each cohort
+#' @export
+#'
+def cohort_outcomes(
+    conn: ColleagueConnection,
+    cohort_years: Union[int, List[int]],
+    horizon_terms: int = 6,
+    cohorts: Union[str, List[str]] = ["FT", "PT", "TF", "TP", "RF", "RP"],
+    use: str = "ipeds_cohorts",
+    ipeds_path: str = "",
+    useonly: bool = True,
+) -> Dict[str, Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]]:
+    """
+    Return the enrollment of each cohort in each of the terms after its cohort term
+
+    All cohort years are done at once: enrollment is computed a single time for every term
+    from the first cohort term to the horizon of the last, and then matched to all the
+    cohort students in one join.
+
+    Args:
+        conn: A ColleagueConnection object
+        cohort_years: The year or list of years of the cohort fall terms
+        horizon_terms: The number of terms after the cohort term to follow each cohort, counted
+            by Term_Index. With fall, spring and summer terms, an offset of 3 is the next fall term
+            (fall-to-fall retention). Default is 6.
+        cohorts, use, ipeds_path, useonly: Passed to ipeds_cohort.
+
+    Returns:
+        A dictionary of pandas or polars dataframes with the keys
+            students   One row per cohort student and term offset from 0 to horizon_terms, with
+                       the term at that offset and whether the student was enrolled in it.
+                       Enrolled is null for terms that are not in Term_CU yet.
+            retention  One row per cohort, cohort term and term offset with the cohort size,
+                       the number of students enrolled and the retention rate.
+    """
+    if horizon_terms < 0:
+        raise ValueError("horizon_terms must be 0 or more.")
+
+    lconn = _local_connection(conn, lazy=False)
+
+    terms, _ = get_terms(lconn)
+    calendar = TermCalendar(terms)
+    term_dtype = terms.schema["Term_ID"]
+
+    cohort = _ipeds_cohort(
+        lconn,
+        report_term_ids=_year_term_ids(terms, cohort_years),
+        cohorts=cohorts,
+        cohort_types="Cohort",
+        use=use,
+        ipeds_path=ipeds_path,
+        useonly=useonly,
+    )
+    cohort = (
+        cohort.select(
+            "Person_ID",
+            "Cohort",
+            Cohort_Term_ID=pl.col("Term_ID").cast(term_dtype, strict=False),
+        )
+        .drop_nulls("Cohort_Term_ID")
+        .unique(
+            subset=["Person_ID", "Cohort", "Cohort_Term_ID"],
+            keep="first",
+            maintain_order=True,
+        )
+    )
+    cohort = cohort.with_columns(
+        Cohort_Term_Index=calendar.term_index(cohort.get_column("Cohort_Term_ID"))
+    )
+
+    # Enrollment for every term any cohort is followed through, computed once
+    first_index = cohort.get_column("Cohort_Term_Index").min()
+    last_index = cohort.get_column("Cohort_Term_Index").max()
+    if first_index is None:
+        horizon = terms.clear()
+    else:
+        horizon = terms.filter(
+            pl.col("Term_Index").is_between(first_index, last_index + horizon_terms)
+        )
+
+    enrollment = (
+        _term_enrollment(
+            _local_connection(conn, lazy=True), terms.lazy(), horizon.lazy()
+        )
+        .filter(pl.col("Enrollment_Status") == "Enrolled")
+        .select("Person_ID", "Term_ID", Enrolled=pl.lit(True))
+        .unique(subset=["Person_ID", "Term_ID"], keep="first", maintain_order=True)
+        .collect()
+    )
+
+    # The cohort x term matrix: each cohort student at each term offset, matched to the
+    #     enrollment in a single join
+    students = (
+        cohort.join(
+            pl.DataFrame(
+                {"Term_Offset": range(horizon_terms + 1)},
+                schema={"Term_Offset": pl.Int16},
+            ),
+            how="cross",
+        )
+        .with_columns(Term_Index=pl.col("Cohort_Term_Index") + pl.col("Term_Offset"))
+        .join(
+            terms.select(["Term_ID", "Term_Index"]),
+            on="Term_Index",
+            how="left",
+            coalesce=True,
+        )
+        .join(
+            enrollment,
+            on=["Person_ID", "Term_ID"],
+            how="left",
+            coalesce=True,
+        )
+        .with_columns(
+            Enrolled=pl.when(pl.col("Term_ID").is_not_null()).then(
+                pl.col("Enrolled").fill_null(False)
+            )
+        )
+        .select(
+            [
+                "Person_ID",
+                "Cohort",
+                "Cohort_Term_ID",
+                "Term_Offset",
+                "Term_ID",
+                "Enrolled",
+            ]
+        )
+        .sort(["Cohort_Term_ID", "Cohort", "Person_ID", "Term_Offset"])
+    )
+
+    retention = (
+        students.group_by(["Cohort_Term_ID", "Cohort", "Term_Offset"])
+        .agg(
+            pl.first("Term_ID"),
+            Cohort_Size=pl.len(),
+            Enrolled=pl.col("Enrolled").sum(),
+            Retention_Rate=pl.col("Enrolled").mean(),
+        )
+        .sort(["Cohort_Term_ID", "Cohort", "Term_Offset"])
+    )
+
+    return {
+        "students": _format_output(students, conn),
+        "retention": _format_output(retention, conn),
+    }
+
+
+#' Return the data for the IPEDS Fall Enrollment survey in one call
+#'
+#' All data comes from CCDW_HIST SQL Server database
+#'
+#' @param report_years The year or a list of years of the fall term for the data. If unspecified, all years are returned.
+#' @param report_semesters Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+#' @param students Also return the enrollment joined with the credential seeker and cohort data for each student.
+#' @export
+#'
+def ipeds_bundle(
+    conn: ColleagueConnection,
+    report_years: Union[int, List[int], None] = None,
+    report_semesters: Union[str, List[str], None] = None,
+    exclude_hs: bool = False,
+    cohorts: Union[str, List[str]] = ["FT", "PT", "TF", "TP", "RF", "RP"],
+    cohort_types: Union[str, List[str]] = "Cohort",
+    use: str = "ipeds_cohorts",
+    ipeds_path: str = "",
+    useonly: bool = True,
+    prefer: str = "file",
+    students: bool = False,
+) -> Dict[str, Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame]]:
+    """
+    Return term_enrollment, credential_seekers and ipeds_cohort for the same years in one call
+
+    The terms are read once and shared, the reference extracts are shared through the
+    reference cache, and the three results are computed concurrently.
+
+    Args:
+        conn: A ColleagueConnection object
+        report_years: The list of years to include in the data. If unspecified, all years are returned.
+        report_semesters: Either a single semester abbreviation or a list of semester abbreviations. If unspecified, all semesters are returned.
+        exclude_hs: Exclude high school students from the credential seekers. See credential_seekers.
+        cohorts, cohort_types, use, ipeds_path, useonly, prefer: Passed to ipeds_cohort.
+        students: Also return a per-student table of the enrollment joined with the
+            credential seeker flag and cohort for the same term. Default is False.
+
+    Returns:
+        A dictionary of pandas or polars dataframes with the keys term_enrollment,
+        credential_seekers, ipeds_cohort and, if requested, students
+    """
+    lconn = _local_connection(conn, lazy=False)
+
+    terms, reporting_terms = get_terms(
+        lconn, report_years=report_years, report_semesters=report_semesters
+    )
+
+    # Each subquery gets its own connection so they can run at the same time
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        enrollment = executor.submit(
+            lambda: _term_enrollment(
+                _local_connection(conn, lazy=True),
+                terms.lazy(),
+                reporting_terms.lazy(),
+                filter_terms=(report_years is not None or report_semesters is not None),
+            ).collect()
+        )
+        seekers = executor.submit(
+            _credential_seekers,
+            _local_connection(conn, lazy=False),
+            terms,
+            reporting_terms,
+            exclude_hs=exclude_hs,
+        )
+        cohort = executor.submit(
+            _ipeds_cohort,
+            _local_connection(conn, lazy=False),
+            report_term_ids=_year_term_ids(terms, report_years),
+            cohorts=cohorts,
+            cohort_types=cohort_types,
+            use=use,
+            ipeds_path=ipeds_path,
+            useonly=useonly,
+            prefer=prefer,
+        )
+
+        results = {
+            "term_enrollment": enrollment.result(),
+            "credential_seekers": seekers.result(),
+            "ipeds_cohort": cohort.result(),
+        }
+
+    if students:
+        results["students"] = (
+            results["term_enrollment"]
+            .join(
+                results["credential_seekers"], on=["Person_ID", "Term_ID"], how="left"
+            )
+            .with_columns(pl.col("Credential_Seeker").fill_null(0))
+            .join(
+                # Cohort terms come from the IPEDS file, so match them to the term Enum
+                _compact(
+                    results["ipeds_cohort"], {"Term_ID": terms.schema["Term_ID"]}
+                ).drop_nulls("Term_ID"),
+                on=["Person_ID", "Term_ID"],
+                how="left",
+            )
+        )
+
+    return {name: _format_output(df, conn) for name, df in results.items()}
 
 
 # For testing purposes only
@@ -0,0 +1,167 @@
+from datetime import date
+from typing import Any, Tuple, Union
+
+import numpy as np
+import polars as pl
+
+
+class TermCalendar(object):
+    """
+    An index of the term calendar for fast lookups of terms by ID or by date.
+
+    terms (DataFrame)  The terms as returned by get_terms, with the Term_ID, Semester,
+                          Term_Reporting_Year, Term_Index, Term_Start_Date, Term_Census_Date
+                          and Term_End_Date columns. This can be a DataFrame or LazyFrame.
+
+    The terms are kept as NumPy arrays sorted by Term_ID, and every lookup is a binary
+    search over those arrays (or over the start and census dates in date order) instead of
+    a join. Lookups take a list, array or Series and return a polars Series with a null
+    wherever there is no matching term.
+    """
+
+    def __init__(self, terms: Union[pl.DataFrame, pl.LazyFrame]):
+        if isinstance(terms, pl.LazyFrame):
+            terms = terms.collect()
+
+        terms = (
+            terms.filter(pl.col("Term_ID").is_not_null())
+            .with_columns(pl.col("Term_ID").cast(pl.Utf8))
+            .sort("Term_ID")
+            .unique(subset="Term_ID", keep="first", maintain_order=True)
+        )
+
+        self.terms = terms
+        self.term_ids = terms.get_column("Term_ID").to_numpy()
+        self.term_indexes = terms.get_column("Term_Index").to_numpy()
+        self.reporting_years = terms.get_column("Term_Reporting_Year").to_numpy()
+        self.start_dates = self._dates(terms.get_column("Term_Start_Date"))
+        self.census_dates = self._dates(terms.get_column("Term_Census_Date"))
+        self.end_dates = self._dates(terms.get_column("Term_End_Date"))
+
+        # Positions of the terms in start date and census date order, for date lookups
+        self._by_start = np.argsort(self.start_dates, kind="stable")
+        self._by_census = np.argsort(self.census_dates, kind="stable")
+
+    def __len__(self) -> int:
+        return len(self.term_ids)
+
+    @staticmethod
+    def _dates(values: Any) -> np.ndarray:
+        # Dates are compared as datetime64[D] so plain dates, strings and Series all work
+        if isinstance(values, pl.Series):
+            values = values.cast(pl.Date).to_numpy()
+
+        return np.asarray(values, dtype="datetime64[D]")
+
+    @property
+    def dtype(self) -> pl.Enum:
+        """
+        The Enum of all the term IDs, in the same order as the calendar arrays.
+        """
+        return pl.Enum(self.term_ids.tolist())
+
+    def positions(self, term_ids: Any) -> np.ndarray:
+        """
+        Return the position of each term ID in the calendar arrays, or -1 if it is unknown.
+        """
+        if isinstance(term_ids, pl.Series):
+            term_ids = term_ids.cast(pl.Utf8)
+        else:
+            term_ids = pl.Series(term_ids, dtype=pl.Utf8)
+
+        term_ids = np.asarray(term_ids.fill_null("").to_numpy(), dtype=object)
+
+        idx = np.searchsorted(self.term_ids, term_ids)
+        found = idx < len(self.term_ids)
+        found[found] = self.term_ids[idx[found]] == term_ids[found]
+
+        return np.where(found, idx, -1)
+
+    def _gather(self, name: str, values: np.ndarray, idx: np.ndarray) -> pl.Series:
+        # Take the calendar values at the given positions, with null for position -1
+        series = pl.Series(name, values)
+        return (
+            pl.DataFrame({"idx": idx})
+            .select(
+                pl.when(pl.col("idx") >= 0).then(
+                    pl.lit(series).gather(pl.col("idx").clip(0, None))
+                )
+            )
+            .to_series()
+            .alias(name)
+        )
+
+    def reporting_year(self, term_ids: Any) -> pl.Series:
+        """
+        Return the reporting year (the year of the fall term) of each term ID.
+        """
+        return self._gather(
+            "Term_Reporting_Year", self.reporting_years, self.positions(term_ids)
+        )
+
+    def term_index(self, term_ids: Any) -> pl.Series:
+        """
+        Return the Term_Index of each term ID.
+        """
+        return self._gather("Term_Index", self.term_indexes, self.positions(term_ids))
+
+    def term_for_date(self, dates: Any) -> pl.Series:
+        """
+        Return the term each date falls in (from the start date through the end date).
+        """
+        dates = self._dates(dates)
+
+        starts = self.start_dates[self._by_start]
+        pos = np.searchsorted(starts, dates, side="right") - 1
+
+        idx = np.where(pos >= 0, self._by_start[np.clip(pos, 0, None)], -1)
+        found = (idx >= 0) & (dates <= self.end_dates[np.clip(idx, 0, None)])
+
+        return self._gather("Term_ID", self.term_ids, np.where(found, idx, -1))
+
+    def census_ranges(self, starts: Any, ends: Any) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        For each date range, return the first and last (exclusive) positions in census date
+        order of the terms whose census date falls within the range. Use census_order to
+        turn the positions into terms.
+        """
+        census = self.census_dates[self._by_census]
+
+        first = np.searchsorted(census, self._dates(starts), side="left")
+        last = np.searchsorted(census, self._dates(ends), side="right")
+
+        return first, np.maximum(first, last)
+
+    @property
+    def census_order(self) -> np.ndarray:
+        """
+        The positions of the terms in census date order.
+        """
+        return self._by_census
+
+    def census_between(
+        self, start: Union[date, str], end: Union[date, str]
+    ) -> pl.Series:
+        """
+        Return the terms whose census date falls between start and end (inclusive).
+        """
+        first, last = self.census_ranges([start], [end])
+
+        return pl.Series(
+            "Term_ID", self.term_ids[self._by_census[first[0] : last[0]]].tolist()
+        )
+
+    def column(self, name: str, term_id: Union[str, pl.Expr] = "Term_ID") -> pl.Expr:
+        """
+        Return an expression looking up a calendar column for a Term_ID column, in place of
+        a join to the terms. The column is cast to the calendar's Enum first, so strings and
+        other Enums work as well. Unknown terms give null.
+        """
+        if isinstance(term_id, str):
+            term_id = pl.col(term_id)
+
+        return (
+            pl.lit(self.terms.get_column(name))
+            .gather(term_id.cast(self.dtype, strict=False).to_physical())
+            .alias(name)
+        )
@@ -1,12 +1,17 @@
 # from __future__ import annotations
 
 import itertools
+import os
+import threading
 
 # import collections.abc
-from typing import Dict, List
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Union
 
+import duckdb as ddb
 import numpy as np
 import pandas as pd
+import polars as pl
 from pycolleague import get_config
 
 
@@ -15,13 +20,147 @@ def load_config():
     return config
 
 
+# In-memory DuckDB databases owned by the package, one per threads/memory_limit setting
+_duckdb_connections: Dict = {}
+_duckdb_lock = threading.Lock()
+
+
+def duckdb_connection(config: Any = None) -> ddb.DuckDBPyConnection:
+    """
+    This returns a cursor on the in-memory DuckDB database used by the package, rather than
+    DuckDB's process-wide default connection.
+
+    config (dict)      The configuration, usually conn.config. The threads and memory_limit
+                          settings in the duckdb section are applied to the database. If these
+                          are not set, the DuckDB defaults are used.
+
+    The database is created on first use and shared by later calls with the same settings.
+    Each call returns a new cursor, so frames registered on it are only visible to the
+    caller and it can be used from its own thread. Close the cursor when done.
+    """
+
+    try:
+        settings = config["duckdb"] or {}
+    except (KeyError, TypeError):
+        settings = {}
+
+    threads = settings.get("threads")
+    memory_limit = settings.get("memory_limit")
+    key = (threads, memory_limit)
+
+    with _duckdb_lock:
+        if key not in _duckdb_connections:
+            duckdb_config = {}
+            if threads:
+                duckdb_config["threads"] = int(threads)
+            if memory_limit:
+                duckdb_config["memory_limit"] = str(memory_limit)
+
+            _duckdb_connections[key] = ddb.connect(":memory:", config=duckdb_config)
+
+        return _duckdb_connections[key].cursor()
+
+
+def as_of_snapshot(
+    frame: Union[pl.DataFrame, pl.LazyFrame],
+    keys: List[str],
+    ts_col: str = "EffectiveDatetime",
+    cutoff: Union[date, datetime, str, pl.Expr, None] = None,
+) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """
+    This returns the latest version of each record in a history table as of a cutoff.
+
+    frame (DataFrame)  A polars DataFrame or LazyFrame with one row per version of each record,
+                          such as an extract with version="history"
+    keys (list)        List of all key columns, used to uniquely identify each record
+    ts_col (str)       The timestamp column identifying each version. This defaults to
+                          EffectiveDatetime.
+    cutoff             Only versions at or before the cutoff are considered. This can be a
+                          date, datetime, ISO date string or a polars expression evaluated
+                          per row (a null cutoff means no cutoff for that row). If unspecified,
+                          the latest version is returned.
+
+    The latest version is found with a single window pass over the frame rather than an
+    aggregation joined back to the frame. If several versions of a record share the latest
+    timestamp, the last of them in frame order is returned, so each record appears once.
+    The result is lazy if frame is lazy.
+    """
+
+    if cutoff is not None:
+        if isinstance(cutoff, str):
+            cutoff = datetime.fromisoformat(cutoff)
+
+        if not isinstance(cutoff, pl.Expr):
+            cutoff = pl.lit(cutoff)
+
+        frame = frame.filter(cutoff.is_null() | (pl.col(ts_col) <= cutoff))
+
+    return frame.filter(pl.col(ts_col) == pl.col(ts_col).max().over(keys)).unique(
+        subset=keys, keep="last", maintain_order=True
+    )
+
+
+def interval_join(
+    intervals: pl.DataFrame,
+    points: pl.DataFrame,
+    start: str,
+    end: str,
+    on: str,
+) -> pl.DataFrame:
+    """
+    This joins each row of intervals to every row of points that falls within the interval.
+
+    intervals (DataFrame)  A polars DataFrame with one interval per row
+    points (DataFrame)     A polars DataFrame with one point per row
+    start (str)            The column in intervals with the start of each interval
+    end (str)              The column in intervals with the end of each interval
+    on (str)               The column in points matched against the intervals. A point
+                              matches an interval when start <= on <= end.
+
+    Points are sorted once and the matching range of each interval is found with a binary
+    search, so only the matching pairs are ever built rather than the full cross join of
+    intervals and points. Rows with a null start, end or point never match. The two frames
+    should not share any column names.
+    """
+
+    points = points.filter(pl.col(on).is_not_null()).sort(on)
+    intervals = intervals.filter(
+        pl.col(start).is_not_null() & pl.col(end).is_not_null()
+    )
+
+    values = points.get_column(on)
+
+    # Each interval matches the points in positions [first, last) of the sorted points
+    matches = (
+        intervals.with_columns(
+            __first=values.search_sorted(intervals.get_column(start), side="left").cast(
+                pl.Int64
+            ),
+            __last=values.search_sorted(intervals.get_column(end), side="right").cast(
+                pl.Int64
+            ),
+        )
+        .with_columns(__point=pl.int_ranges("__first", "__last"))
+        .drop(["__first", "__last"])
+        .explode("__point")
+        # Intervals without any points explode to a single null row
+        .drop_nulls("__point")
+    )
+
+    return pl.concat(
+        [matches.drop("__point"), points[matches.get_column("__point")]],
+        how="horizontal",
+    )
+
+
 def mv_to_delim(
-    df: pd.DataFrame,
+    df: Union[pd.DataFrame, pl.DataFrame],
     keys: List[str] = None,  # type: ignore
     assoc: Dict = {},
     cols: List[str] = None,  # type: ignore
     delim: str = ", ",
-) -> pd.DataFrame:
+    engine: str = "polars",
+) -> Any:
     """
     This converts a multi-valued column into a delimiter-separated column.
 
@@ -32,6 +171,15 @@ def mv_to_delim(
                           are collapsed individually.
     delim (str)        The separator to use between values. This defaults to a comma
                           followed by a space.
+    engine (str)       "polars" (the default) or "duckdb" to run the conversion as SQL
+
+    df can be a pandas or polars DataFrame, and the result is the same kind of DataFrame.
+    With engine="duckdb", df can also be a path to a CSV or Parquet file, giving a polars
+    DataFrame, or a DuckDB relation, giving a relation. A relation's rows are only read
+    when its result is, for example with write_parquet. The rows must be in file order.
+
+    Within a group, missing values become empty strings in the delimited string. A group
+    holding a single missing value stays missing.
 
     That is, it takes this:
 
@@ -50,11 +198,7 @@ def mv_to_delim(
 
     """
 
-    # Get all the columns in the original order to restore at the end
-    colnames = list(df.columns)
-
-    # Get names of columns used in the associations
-    assoc_cols = list(set(itertools.chain(*list(assoc.values())))) if assoc else []
+    _check_engine(engine)
 
     if keys is None:
         keys = []
@@ -62,75 +206,131 @@ def mv_to_delim(
     if cols is None:
         cols = []
 
-    # Get list of columns not used at all, and create a dataframe with those columns with the keys,
-    #   removing all the rows where all the columns are NAs (these were created for the multi-valued columns)
-    unused_cols = list(set(colnames) - set(keys) - set(assoc_cols) - set(cols))
-    result_df = df.loc[:, keys + unused_cols].dropna(axis=0, how="all")
-
-    def _process_list(
-        df: pd.DataFrame,
-        keys: List = None,  # type: ignore
-        lst: List = None,  # type: ignore
-        delim: str = ", ",
-    ):
-        if keys is None:
-            keys = []
-
-        if lst is None:
-            lst = []
-
-        # Replace NAs and NaNs with a string that we can replace later to restore with NaNs
-        fillval = "FILLNA__3RvmHNI2SSQSHihTz8Te5JTIdCgjd__ANLLIF"
-
-        # Create a temporary dataframe with just the needed columns and remove the rows where all the columns are NAs
-        dfl = df.loc[:, keys + lst].dropna(axis=0, how="all")
-
-        # Fill down the keys
-        dfl.loc[:, keys] = dfl.loc[:, keys].ffill()
-        dfl = dfl.fillna(fillval)
-
-        # Collapse rows of data grouped by the keys into a delimiter-separated string
-        # and then replace the fill string inserted above with NaNs.
-        # There are 2 replacements to replace stand-alone fill strings and fill strings
-        # that were collapsed into one of the delimiter-separated strings.
-        # Could also use the following:
-        # return((
-        #     dfl
-        #     .pivot_table(index=keys, values=lst, aggfunc=lambda x: delim.join(x))
-        #     .reset_index()
-        #     .replace(fillval, np.nan)
-        #     .replace(to_replace=fillval, value='', regex=True)
-        # ))
-        return (
-            dfl.groupby(keys, as_index=False)
-            .agg(delim.join)
-            .replace(fillval, np.nan)
-            .replace(to_replace=fillval, value="", regex=True)
+    groups = [list(acols) for acols in assoc.values()] + [[col] for col in cols]
+
+    if engine == "duckdb":
+        return _duckdb_convert(
+            df, lambda rel: _duckdb_mv_to_delim(rel, keys, groups, delim)
         )
 
-    # Process the associations one by one and add them back into the result df
-    if assoc:
-        for akey in assoc.keys():
-            acols = assoc[akey]
+    # Get all the columns in the original order to restore at the end
+    colnames = list(df.columns)
 
-            dfk = _process_list(df, keys, acols, delim)
+    # Get names of columns used in the associations
+    assoc_cols = list(set(itertools.chain(*list(assoc.values())))) if assoc else []
 
-            # Add these records to the result table
-            result_df = pd.merge(result_df, dfk, on=keys, how="left")
+    # Get list of columns not used at all. The result has a row for each row where any of
+    #   these columns or the keys has a value (the others were created for the multi-valued columns)
+    unused_cols = list(set(colnames) - set(keys) - set(assoc_cols) - set(cols))
+    mv_cols = list(itertools.chain(*groups))
 
-    # Process the columns that remain one by one and add them back into the result df
-    for col in cols:
-        collst = [col]
+    if isinstance(df, pl.DataFrame):
+        rows = df.select(
+            pl.any_horizontal(pl.col(keys + unused_cols).is_not_null())
+        ).to_series()
+
+        collapsed = _collapse_mv(df.select(keys + mv_cols), keys, groups, delim, rows)
+
+        return pl.concat(
+            [df.select(keys + unused_cols).filter(rows), collapsed], how="horizontal"
+        ).select(colnames)
 
-        dfc = _process_list(df, keys, collst, delim)
+    # Only the keys and the multi-valued columns go through polars, so the unused columns
+    #   keep their pandas dtypes
+    rows = df.loc[:, keys + unused_cols].notna().any(axis=1)
+    result_df = df.loc[rows, keys + unused_cols].reset_index(drop=True)
 
-        # Add these records to the result table
-        result_df = pd.merge(result_df, dfc, on=keys, how="left")
+    collapsed = _collapse_mv(
+        pl.from_pandas(df.loc[:, keys + mv_cols]),
+        keys,
+        groups,
+        delim,
+        pl.Series(rows.to_numpy()),
+    ).to_pandas()
+
+    for col in collapsed.columns:
+        result_df[col] = collapsed[col].where(collapsed[col].notna(), np.nan).to_numpy()
 
     # Return the result dataframe with the columns in the original order
     return result_df.loc[:, colnames]
 
 
+# Join a list column into a delimiter-separated string. Missing values become empty
+#   strings, except that an empty list or a list holding a single missing value stays missing.
+def _join_mv(col: str, delim: str) -> pl.Expr:
+    return (
+        pl.when((pl.col(col).list.len() <= 1) & pl.col(col).list.first().is_null())
+        .then(pl.lit(None, dtype=pl.Utf8))
+        .otherwise(pl.col(col).list.eval(pl.element().fill_null("")).list.join(delim))
+        .alias(col)
+    )
+
+
+# Collapse all the groups of multi-valued columns by the filled-down keys in one group_by
+#   and line the delimited strings up with the result rows (the rows flagged in rows).
+#   Each group only takes the rows with a value in the keys or in that group. Rows with
+#   missing keys match the group of rows before the first key, as pandas merges them.
+def _collapse_mv(
+    frame: pl.DataFrame,
+    keys: List[str],
+    groups: List[List[str]],
+    delim: str,
+    rows: pl.Series,
+) -> pl.DataFrame:
+    # Keys with no values at all have no dtype to fill down
+    frame = frame.with_columns(
+        [pl.col(key).cast(pl.Utf8) for key in keys if frame.schema[key] == pl.Null]
+    )
+    result = frame.select(keys).filter(rows)
+
+    if not groups:
+        return result.drop(keys)
+
+    # The rows dropped from a group have no keys, so filling down the keys once for all
+    #   the rows gives the same keys as filling them down for each group
+    present = [f"__present_{i}" for i in range(len(groups))]
+    frame = frame.with_columns(
+        [pl.col(col).cast(pl.Utf8) for group in groups for col in group]
+        + [
+            pl.any_horizontal(pl.col(keys + group).is_not_null()).alias(flag)
+            for flag, group in zip(present, groups)
+        ]
+    ).with_columns(pl.col(keys).forward_fill())
+
+    collapsed = (
+        frame.group_by(keys, maintain_order=True)
+        .agg(
+            [
+                pl.col(col).filter(pl.col(flag))
+                for flag, group in zip(present, groups)
+                for col in group
+            ]
+        )
+        .with_columns([_join_mv(col, delim) for group in groups for col in group])
+    )
+
+    # Missing keys have to match each other, so join on a filled copy of each key plus a
+    #   flag marking the missing ones
+    on = [f"__key_{i}" for i in range(len(keys))] + [
+        f"__missing_{i}" for i in range(len(keys))
+    ]
+    null_safe = [
+        pl.col(key).cast(pl.Utf8).fill_null("").alias(f"__key_{i}")
+        for i, key in enumerate(keys)
+    ] + [pl.col(key).is_null().alias(f"__missing_{i}") for i, key in enumerate(keys)]
+
+    return (
+        result.with_columns(null_safe)
+        .join(
+            collapsed.with_columns(null_safe).drop(keys),
+            on=on,
+            how="left",
+            coalesce=True,
+        )
+        .drop(keys + on)
+    )
+
+
 def mv_to_commas(
     df: pd.DataFrame,
     keys: List = None,  # type: ignore
@@ -147,12 +347,13 @@ def mv_to_commas(
 
 
 def delim_to_mv(
-    df: pd.DataFrame,
+    df: Union[pd.DataFrame, pl.DataFrame],
     keys: List = None,  # type: ignore
     cols: List = None,  # type: ignore
     delim: str = ", ",
     fill: bool = True,
-) -> pd.DataFrame:
+    engine: str = "polars",
+) -> Any:
     """
     This converts a delimiter-separated column into a multi-valued column.
 
@@ -162,7 +363,12 @@ def delim_to_mv(
     delim (str)        The separator to use between values. This defaults to a comma
                           followed by a space.
     fill (bool)        Keep column filled with duplicates (True) or replace with NaN (False)
-                          [NOT IMPLEMENTED YET]
+    engine (str)       "polars" (the default) or "duckdb" to run the conversion as SQL
+
+    df can be a pandas or polars DataFrame, and the result is the same kind of DataFrame.
+    With engine="duckdb", df can also be a path or a DuckDB relation, as for mv_to_delim.
+    Each row becomes one row per value, so every column in cols must have the same number
+    of values in a row (a missing value counts as any number of missing values).
 
     That is, it takes this:
 
@@ -181,48 +387,256 @@ def delim_to_mv(
 
     """
 
+    _check_engine(engine)
+
     if keys is None:
         keys = []
 
     if cols is None:
         cols = []
 
+    if engine == "duckdb":
+        return _duckdb_convert(
+            df, lambda rel: _duckdb_delim_to_mv(rel, cols, delim, fill)
+        )
+
     # Get all the columns in the original order to restore at the end
     colnames = list(df.columns)
 
-    # Get list of columns not used at all, and create a dataframe with those columns with the keys,
-    #   removing all the rows where all the columns are NAs (these were created for the multi-valued columns)
-    unused_cols = list(set(colnames) - set(keys) - set(cols))
-    result_df = df.loc[:, keys + unused_cols]
+    # Get list of columns not split. These are repeated for each value, or only kept on
+    #   the first value of each row when fill is False.
+    other_cols = [col for col in colnames if col not in set(cols)]
 
-    build_df = pd.DataFrame()
+    if not cols:
+        return df.select(colnames) if isinstance(df, pl.DataFrame) else df.copy()
 
-    for col in cols:
-        collst = [col]
-
-        dfc = (
-            df.loc[:, keys + collst]
-            .set_index(keys)[collst]
-            .apply(lambda x: x.split(delim) if type(x) == str else x.str.split(delim))
-            .explode(collst)
-            # .str
-            # .strip()
-            .reset_index()
-        )
+    if isinstance(df, pl.DataFrame):
+        split = _split_delim(df.select(cols), cols, delim)
+
+        result = pl.concat(
+            [
+                df.select(other_cols).with_columns(
+                    pl.Series("__row", np.arange(df.height))
+                ),
+                split,
+            ],
+            how="horizontal",
+        ).explode(cols)
 
-        if build_df.empty:
-            build_df = dfc.copy()
-        else:
-            build_df[collst] = dfc.loc[:, collst]
+        if not fill:
+            result = result.with_columns(
+                pl.when(pl.col("__row").is_first_distinct()).then(pl.col(other_cols))
+            )
 
-    result_df = pd.merge(result_df, build_df, on=keys, how="left")
+        return result.select(colnames)
+
+    split = _split_delim(pl.from_pandas(df.loc[:, cols]), cols, delim)
+    counts = split.select(pl.col(cols[0]).list.len().clip(1, None)).to_series()
+
+    # Repeat the other columns in pandas so they keep their dtypes
+    rows = np.repeat(np.arange(len(df)), counts.to_numpy())
+    result_df = df.loc[:, other_cols].iloc[rows].reset_index(drop=True)
 
     if not fill:
-        pass
+        result_df.loc[pd.Series(rows).duplicated().to_numpy(), other_cols] = np.nan
+
+    exploded = split.explode(cols).to_pandas()
+
+    for col in cols:
+        result_df[col] = exploded[col].where(exploded[col].notna(), np.nan).to_numpy()
 
     return result_df.loc[:, colnames]
 
 
+# Split the delimiter-separated columns into lists with the same length in each row,
+#   ready for one explode of all the columns. A missing value becomes a list of missing
+#   values as long as the other lists in its row.
+def _split_delim(frame: pl.DataFrame, cols: List[str], delim: str) -> pl.DataFrame:
+    split = frame.select(pl.col(cols).cast(pl.Utf8).str.split(delim))
+
+    # Missing values have no length, so they match the other columns in the row
+    counts = [
+        pl.when(pl.col(col).is_not_null()).then(pl.col(col).list.len()) for col in cols
+    ]
+    lengths = pl.max_horizontal(counts)
+
+    mismatched = split.filter(
+        pl.any_horizontal([count != lengths for count in counts]).fill_null(False)
+    ).height
+    if mismatched:
+        raise ValueError(
+            f"{mismatched} rows have a different number of values in the columns {cols}"
+        )
+
+    return split.with_columns(
+        pl.col(cols).fill_null(pl.lit(None, dtype=pl.Utf8).repeat_by(lengths))
+    )
+
+
+def _check_engine(engine: str):
+    if engine not in ("polars", "duckdb"):
+        raise ValueError(f"engine must be 'polars' or 'duckdb', not {engine!r}")
+
+
+# Quote a column name or a string for use in SQL
+def _sql_name(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_string(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Run a DuckDB conversion on a relation, a CSV or Parquet file, or a DataFrame. A relation
+#   gives back a relation on its own connection, a file gives a polars DataFrame and a
+#   DataFrame gives the same kind of DataFrame.
+def _duckdb_convert(source: Any, convert: Any) -> Any:
+    if isinstance(source, ddb.DuckDBPyRelation):
+        return convert(source)
+
+    conn = duckdb_connection()
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            path = os.fspath(source)
+            if path.lower().endswith(".parquet"):
+                return convert(conn.read_parquet(path)).pl()
+            return convert(conn.read_csv(path, all_varchar=True)).pl()
+
+        if isinstance(source, pl.DataFrame):
+            return convert(conn.from_arrow(source.to_arrow())).pl()
+
+        result_df = convert(conn.from_df(source)).df()
+        return result_df.where(result_df.notna(), np.nan)
+    finally:
+        conn.close()
+
+
+# The SQL version of mv_to_delim: fill the keys down with a window in row order, collapse
+#   each group with string_agg in row order over the rows that belong to it, and join the
+#   strings back to the result rows the same way as the polars version
+def _duckdb_mv_to_delim(
+    rel: ddb.DuckDBPyRelation, keys: List[str], groups: List[List[str]], delim: str
+) -> ddb.DuckDBPyRelation:
+    colnames = list(rel.columns)
+    mv_cols = list(itertools.chain(*groups))
+    result_cols = [col for col in colnames if col not in set(mv_cols)]
+
+    fill = [
+        f"last_value({_sql_name(key)} IGNORE NULLS) OVER (ORDER BY __pos ROWS "
+        f"BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS __key_{i}"
+        for i, key in enumerate(keys)
+    ]
+    present = [
+        "(" + " OR ".join(f"{_sql_name(col)} IS NOT NULL" for col in keys + group) + ")"
+        f" AS __present_{i}"
+        for i, group in enumerate(groups)
+    ]
+
+    aggs = []
+    for i, group in enumerate(groups):
+        for col in group:
+            rows = f"FILTER (WHERE __present_{i})"
+            aggs.append(
+                f"CASE WHEN count({_sql_name(col)}) {rows} = 0 "
+                f"AND count(*) {rows} <= 1 THEN NULL "
+                f"ELSE string_agg(coalesce(CAST({_sql_name(col)} AS VARCHAR), ''), "
+                f"{_sql_string(delim)} ORDER BY __pos) {rows} END AS {_sql_name(col)}"
+            )
+
+    key_names = ", ".join(f"__key_{i}" for i in range(len(keys)))
+    on = " AND ".join(
+        f"s.{_sql_name(key)} IS NOT DISTINCT FROM c.__key_{i}"
+        for i, key in enumerate(keys)
+    )
+    rows = " OR ".join(f"s.{_sql_name(col)} IS NOT NULL" for col in result_cols)
+    select = ", ".join(
+        f"c.{_sql_name(col)}" if col in set(mv_cols) else f"s.{_sql_name(col)}"
+        for col in colnames
+    )
+
+    collapsed = (
+        f"""
+        , filled AS (SELECT *, {", ".join(fill + present)} FROM src)
+        , collapsed AS (
+            SELECT {key_names}, {", ".join(aggs)} FROM filled GROUP BY {key_names}
+        )
+        """
+        if groups
+        else ", collapsed AS (SELECT NULL AS __none)"
+    )
+
+    return rel.query(
+        "__source",
+        f"""
+        WITH src AS (SELECT *, row_number() OVER () AS __pos FROM __source)
+        {collapsed}
+        SELECT {select}
+        FROM src s LEFT JOIN collapsed c ON {on if groups else "FALSE"}
+        WHERE {rows or "FALSE"}
+        ORDER BY s.__pos
+        """,
+    )
+
+
+# The SQL version of delim_to_mv: split the columns with string_split and unnest them
+#   together with the positions, so the values line up and short lists are padded
+def _duckdb_delim_to_mv(
+    rel: ddb.DuckDBPyRelation, cols: List[str], delim: str, fill: bool
+) -> ddb.DuckDBPyRelation:
+    colnames = list(rel.columns)
+    select = ", ".join(_sql_name(col) for col in colnames)
+
+    if not cols:
+        return rel.project(select)
+
+    splits = [
+        f"string_split(CAST({_sql_name(col)} AS VARCHAR), {_sql_string(delim)}) "
+        f"AS __split_{i}"
+        for i, col in enumerate(cols)
+    ]
+    lengths = ", ".join(f"coalesce(len(__split_{i}), 0)" for i in range(len(cols)))
+
+    sized = f"""
+        WITH src AS (SELECT *, row_number() OVER () AS __row FROM __source)
+        , split AS (SELECT *, {", ".join(splits)} FROM src)
+        , sized AS (SELECT *, greatest(1, {lengths}) AS __n FROM split)
+        """
+
+    mismatched = rel.query(
+        "__source",
+        sized
+        + "SELECT count(*) FROM sized WHERE "
+        + " OR ".join(f"len(__split_{i}) <> __n" for i in range(len(cols))),
+    ).fetchone()[0]
+    if mismatched:
+        raise ValueError(
+            f"{mismatched} rows have a different number of values in the columns {cols}"
+        )
+
+    others = [col for col in colnames if col not in set(cols)]
+    values = [f"unnest(__split_{i}) AS {_sql_name(col)}" for i, col in enumerate(cols)]
+    output = ", ".join(
+        (
+            _sql_name(col)
+            if col in set(cols) or fill
+            else f"CASE WHEN __pos = 0 THEN {_sql_name(col)} END AS {_sql_name(col)}"
+        )
+        for col in colnames
+    )
+
+    return rel.query(
+        "__source",
+        sized + f"""
+        , exploded AS (
+            SELECT __row, {", ".join([_sql_name(col) for col in others] + values)},
+                unnest(range(__n)) AS __pos
+            FROM sized
+        )
+        SELECT {output} FROM exploded ORDER BY __row, __pos
+        """,
+    )
+
+
 def commas_to_mv(
     df: pd.DataFrame,
     keys: List = None,  # type: ignore
@@ -238,6 +652,147 @@ def commas_to_mv(
     return delim_to_mv(df, keys=keys, cols=cols, delim=", ", fill=fill)
 
 
+def iter_mv_to_delim(
+    source: Union[str, os.PathLike, Iterable],
+    keys: List[str] = None,  # type: ignore
+    assoc: Dict = {},
+    cols: List[str] = None,  # type: ignore
+    delim: str = ", ",
+    chunk_size: int = 100_000,
+) -> Iterator[Union[pd.DataFrame, pl.DataFrame]]:
+    """
+    A streaming version of mv_to_delim for data too large to load at once.
+
+    source (str)       A path to a CSV or Parquet file, or an iterable of pandas or polars
+                          DataFrames (the pieces of one multi-valued table, in order)
+    keys, assoc, cols, delim
+                       As for mv_to_delim
+    chunk_size (int)   The number of rows to read and process at a time
+
+    The rows are read chunk_size at a time and the converted rows are yielded as they are
+    done, so memory use depends on the chunk size and not the size of the file. Each record
+    starts at a row with a value in one of the keys and runs until the next such row, so
+    the rows must be in order. The rows of a record that is cut off at the end of a chunk
+    are carried into the next chunk. A file path yields polars DataFrames; otherwise the
+    results are the same kind of DataFrame as the pieces.
+    """
+
+    if keys is None:
+        keys = []
+
+    carry = None
+
+    for chunk in _iter_chunks(source, chunk_size):
+        frame = chunk if carry is None else _concat_frames([carry, chunk])
+
+        # Convert everything before the start of the last record, which may continue
+        #   into the next chunk
+        starts = _record_starts(frame, keys)
+        cut = starts[-1] if len(starts) else 0
+
+        if cut > 0:
+            yield mv_to_delim(
+                _slice_frame(frame, 0, cut),
+                keys=keys,
+                assoc=assoc,
+                cols=cols,
+                delim=delim,
+            )
+
+        carry = _slice_frame(frame, cut, len(frame))
+
+    if carry is not None and len(carry):
+        yield mv_to_delim(carry, keys=keys, assoc=assoc, cols=cols, delim=delim)
+
+
+def iter_delim_to_mv(
+    source: Union[str, os.PathLike, Iterable],
+    keys: List = None,  # type: ignore
+    cols: List = None,  # type: ignore
+    delim: str = ", ",
+    fill: bool = True,
+    chunk_size: int = 100_000,
+) -> Iterator[Union[pd.DataFrame, pl.DataFrame]]:
+    """
+    A streaming version of delim_to_mv for data too large to load at once.
+
+    source (str)       A path to a CSV or Parquet file, or an iterable of pandas or polars
+                          DataFrames
+    keys, cols, delim, fill
+                       As for delim_to_mv
+    chunk_size (int)   The number of rows to read and process at a time
+
+    Each row is split on its own, so the chunks are converted and yielded one at a time.
+    A file path yields polars DataFrames; otherwise the results are the same kind of
+    DataFrame as the pieces.
+    """
+
+    for chunk in _iter_chunks(source, chunk_size):
+        yield delim_to_mv(chunk, keys=keys, cols=cols, delim=delim, fill=fill)
+
+
+# Read a CSV or Parquet file, or re-slice an iterable of frames, in pieces of at most
+#   chunk_size rows. CSV columns are all read as strings.
+def _iter_chunks(
+    source: Union[str, os.PathLike, Iterable], chunk_size: int
+) -> Iterator[Union[pd.DataFrame, pl.DataFrame]]:
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+
+    if isinstance(source, (str, os.PathLike)):
+        if os.fspath(source).lower().endswith(".parquet"):
+            # Only the streaming readers need pyarrow, so it is imported here
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+                yield pl.from_arrow(batch)  # type: ignore
+            return
+
+        reader = pl.read_csv_batched(
+            source, batch_size=chunk_size, infer_schema_length=0
+        )
+        while True:
+            batches = reader.next_batches(1)
+            if not batches:
+                return
+            yield from _iter_chunks(batches, chunk_size)
+
+    for frame in source:
+        for start in range(0, len(frame), chunk_size):
+            yield _slice_frame(frame, start, start + chunk_size)
+
+
+# Positions of the rows that start a record, the rows with a value in any of the keys
+def _record_starts(frame: Union[pd.DataFrame, pl.DataFrame], keys: List[str]) -> Any:
+    if isinstance(frame, pl.DataFrame):
+        return (
+            frame.select(pl.any_horizontal(pl.col(keys).is_not_null()))
+            .to_series()
+            .arg_true()
+            .to_numpy()
+        )
+
+    return np.flatnonzero(frame.loc[:, keys].notna().any(axis=1).to_numpy())
+
+
+def _slice_frame(
+    frame: Union[pd.DataFrame, pl.DataFrame], start: int, end: int
+) -> Union[pd.DataFrame, pl.DataFrame]:
+    if isinstance(frame, pl.DataFrame):
+        return frame.slice(start, end - start)
+
+    return frame.iloc[start:end]
+
+
+def _concat_frames(
+    frames: List[Union[pd.DataFrame, pl.DataFrame]],
+) -> Union[pd.DataFrame, pl.DataFrame]:
+    if isinstance(frames[0], pl.DataFrame):
+        return pl.concat(frames, how="vertical_relaxed")
+
+    return pd.concat(frames, ignore_index=True)
+
+
 if __name__ == "__main__":
     cfg = load_config()
 
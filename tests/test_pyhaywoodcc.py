@@ -1,10 +1,989 @@
+import contextlib
+import threading
 import unittest
 
 
+# Colleague tables for the ipeds tests: four terms, six students and one dropped course
+def _colleague_tables():
+    from datetime import date, datetime
+
+    import polars as pl
+
+    terms = [
+        ("2019FA", 1, date(2019, 8, 15), date(2019, 9, 1), date(2019, 12, 15), 2020),
+        ("2020SP", 2, date(2020, 1, 10), date(2020, 2, 1), date(2020, 5, 10), 2020),
+        ("2020SU", 3, date(2020, 5, 20), date(2020, 6, 10), date(2020, 7, 30), 2020),
+        ("2020FA", 4, date(2020, 8, 15), date(2020, 9, 1), date(2020, 12, 15), 2021),
+    ]
+    term_cu = pl.DataFrame(
+        {
+            "Term_ID": [t[0] for t in terms],
+            "Term_Index": [t[1] for t in terms],
+            "Semester": [f"{t[0][4:]} {t[0][:4]}" for t in terms],
+            "Term_Abbreviation": [t[0][4:] for t in terms],
+            "Term_Start_Date": [t[2] for t in terms],
+            "Term_Census_Date": [t[3] for t in terms],
+            "Term_End_Date": [t[4] for t in terms],
+            "Reporting_Year_FSS": [str(t[5]) for t in terms],
+            "Reporting_Academic_Year_FSS": [f"{t[5] - 1}-{t[5]}" for t in terms],
+        }
+    )
+
+    sections = pl.DataFrame(
+        {
+            "COURSE.SECTIONS.ID": [f"{t[0]}-{s}" for t in terms for s in (1, 2)],
+            "SEC.TERM": [t[0] for t in terms for s in (1, 2)],
+            "SEC.LOCATION": ["MAIN", "EAST"] * len(terms),
+            "X.SEC.DELIVERY.METHOD": ["IN", "TR"] * len(terms),
+            "X.SEC.DELIVERY.MODE": ["A", "B"] * len(terms),
+        }
+    )
+
+    sac = []
+    for p in range(1, 7):
+        for i, t in enumerate(terms):
+            if (p + i) % 3 == 0:
+                continue
+            for c in range(1 + (p + i) % 4):
+                section = f"{t[0]}-{1 + (p + c) % 2}"
+                versions = [("A", datetime(t[2].year, t[2].month, 20))]
+                if p == 4 and c == 0:
+                    versions.append(("D", datetime(t[3].year, t[3].month, 10)))
+                for status, effective in versions:
+                    sac.append(
+                        {
+                            "STC.PERSON.ID": f"{p:07d}",
+                            "STC.TERM": t[0],
+                            "STUDENT.ACAD.CRED.ID": f"{p}{i}{c}",
+                            "STC.CRED": 4.0 if c == 0 else 3.0,
+                            "STC.COURSE.LEVEL": "DEV" if p == 2 and c == 0 else "100",
+                            "STC.VERIFIED.GRADE": "A",
+                            "STC.SECTION.NO": section[-1:],
+                            "STC.COURSE.SECTION": section,
+                            "STC.STATUS": status,
+                            "EffectiveDatetime": effective,
+                            "STC.ACAD.LEVEL": "CU",
+                        }
+                    )
+
+    return {
+        "Term_CU": term_cu,
+        "COURSE_SECTIONS": sections,
+        "STUDENT_ACAD_CRED": pl.DataFrame(sac),
+        "ACAD_PROGRAMS": pl.DataFrame(
+            {
+                "ACAD.PROGRAMS.ID": ["A10100", "C20200", "N30300", "CE1"],
+                "ACPG.ACAD.LEVEL": ["CU", "CU", "CU", "CE"],
+            }
+        ),
+        "STUDENT_PROGRAMS__STPR_DATES": pl.DataFrame(
+            {
+                "STPR.STUDENT": [f"{p:07d}" for p in (1, 2, 3, 4, 5, 6)],
+                "STPR.ACAD.PROGRAM": [
+                    "A10100",
+                    "C20200",
+                    "C20200",
+                    "CE1",
+                    "A10100",
+                    "N30300",
+                ],
+                "STPR.START.DATE": [date(2019, 8, 1)] * 5 + [date(2020, 8, 1)],
+                "STPR.END.DATE": [None, date(2020, 5, 30), None, None, None, None],
+            }
+        ),
+        "STUDENTS__STU_TYPES": pl.DataFrame(
+            {
+                "STUDENTS.ID": ["0000003"],
+                "STU.TYPES": ["HUSK"],
+                "STU.TYPE.DATES": [date(2019, 8, 1)],
+                "STU.TYPE.END.DATES": [date(2020, 6, 30)],
+            }
+        ),
+        "STUDENT_TERMS": pl.DataFrame(
+            {
+                "STTR.STUDENT": ["0000001", "0000002", "0000003", "0000006"],
+                "STTR.TERM": ["2019FA", "2020SP", "2020FA", "2020FA"],
+                "STTR.FED.COHORT.GROUP": ["FT", None, "PT", "TF"],
+            }
+        ),
+        "ipeds_cohorts": pl.DataFrame(
+            {
+                "ID": ["0000001", "0000002", "0000003", "0000004", "0000005"],
+                "Term_ID": ["2019FA", "2019FA", "2019FA", "2019FA", "2020FA"],
+                "Cohort": ["FT", "PT", "TF", None, "FT"],
+                "OM_Cohort": ["FTFT", "PTFT", None, None, "FTFT"],
+                "Term_Cohort": ["FT", "PT", None, None, "FT"],
+            }
+        ),
+    }
+
+
+# Stands in for a ColleagueConnection, answering get_data from the tables above.
+#     The where clause is run through DuckDB after turning [COLUMN] into "COLUMN".
+#     Partitions are read from several threads, so reads take turns on the tables.
+class FakeColleagueConnection(object):
+    tables = {}
+    lock = threading.Lock()
+
+    def __init__(
+        self,
+        source="ccdw",
+        sourcepath="",
+        format="polars",
+        lazy=False,
+        config=None,
+        read_only=True,
+    ):
+        self.source = source
+        self.sourcepath = sourcepath
+        self.df_format = format
+        self.lazy = lazy
+        self.config = config if config is not None else {}
+        self.read_only = read_only
+
+    def get_data(self, file, cols=None, where="", schema="history", version="latest"):
+        import re
+
+        import duckdb
+        import polars as pl
+
+        with self.lock:
+            df = self.tables[file].clone()
+        if where and where.strip():
+            sql = re.sub(r"/\*.*?\*/", "", where, flags=re.S)
+            sql = re.sub(r"IN\s*\[([^\]]*)\]", r"IN (\1)", sql)
+            sql = re.sub(r"\[([A-Za-z_][A-Za-z0-9_.]*)\]", r'"\1"', sql)
+            sql = sql.replace("==", "=")
+            with duckdb.connect() as con:
+                con.register("t", df.to_arrow())
+                rows = pl.from_arrow(con.sql(f"SELECT * FROM t WHERE {sql}").arrow())
+            df = df.clear() if rows.height == 0 else rows
+        if cols:
+            df = df.select([pl.col(s).alias(d) for s, d in cols.items()])
+        if self.df_format == "pandas":
+            return df.to_pandas()
+        return df.lazy() if self.lazy else df
+
+
+# Point the ipeds module at FakeColleagueConnection serving tables (the tables above by
+#     default) and yield a connection to pass to the reports. The reference cache is
+#     cleared first so a test never sees the tables of another.
+@contextlib.contextmanager
+def _fake_colleague(tables=None, **kwargs):
+    from unittest import mock
+
+    from pyhaywoodcc import ipeds
+    from pyhaywoodcc.cache import invalidate_reference_cache
+
+    invalidate_reference_cache(source="test")
+    with (
+        mock.patch.object(ipeds, "LocalConnection", FakeColleagueConnection),
+        mock.patch.object(
+            FakeColleagueConnection,
+            "tables",
+            _colleague_tables() if tables is None else tables,
+        ),
+    ):
+        yield FakeColleagueConnection(source="test", **kwargs)
+
+
 class TestPyHaywoodCC(unittest.TestCase):
     def test_import(self):
         import pyhaywoodcc
 
+    def test_as_of_snapshot(self):
+        from datetime import datetime
+
+        import polars as pl
+
+        from pyhaywoodcc import as_of_snapshot
+
+        df = pl.DataFrame(
+            {
+                "ID": ["01", "01", "01", "02", "02"],
+                "Status": ["A", "W", "D", "A", "N"],
+                "EffectiveDatetime": [
+                    datetime(2023, 9, 1),
+                    datetime(2023, 10, 1),
+                    datetime(2023, 11, 1),
+                    datetime(2023, 9, 1),
+                    datetime(2023, 9, 2),
+                ],
+            }
+        )
+
+        latest = as_of_snapshot(df, keys=["ID"]).sort("ID")
+        self.assertEqual(latest["Status"].to_list(), ["D", "N"])
+
+        as_of = as_of_snapshot(df, keys=["ID"], cutoff=datetime(2023, 10, 15)).sort(
+            "ID"
+        )
+        self.assertEqual(as_of["Status"].to_list(), ["W", "N"])
+
+        lazy = as_of_snapshot(df.lazy(), keys=["ID"], cutoff="2023-09-01")
+        self.assertIsInstance(lazy, pl.LazyFrame)
+        self.assertEqual(lazy.collect().sort("ID")["Status"].to_list(), ["A", "A"])
+
+        # Versions tied on the latest timestamp collapse to the last one in frame order
+        tied = pl.concat(
+            [df, df.filter(pl.col("Status") == "D").with_columns(Status=pl.lit("X"))]
+        )
+        latest = as_of_snapshot(tied, keys=["ID"]).sort("ID")
+        self.assertEqual(latest["Status"].to_list(), ["X", "N"])
+
+    def test_interval_join(self):
+        from datetime import date
+
+        import polars as pl
+
+        from pyhaywoodcc import interval_join
+
+        programs = pl.DataFrame(
+            {
+                "ID": ["01", "02", "03"],
+                "Start": [date(2023, 8, 1), date(2024, 1, 1), None],
+                "End": [date(2024, 5, 1), date(2024, 1, 31), date(2024, 5, 1)],
+            }
+        )
+        terms = pl.DataFrame(
+            {
+                "Term_ID": ["2024SP", "2023FA", "2024SU"],
+                "Census": [date(2024, 1, 25), date(2023, 9, 1), date(2024, 6, 1)],
+            }
+        )
+
+        joined = interval_join(programs, terms, start="Start", end="End", on="Census")
+        self.assertEqual(
+            sorted(joined.select(["ID", "Term_ID"]).rows()),
+            [("01", "2023FA"), ("01", "2024SP"), ("02", "2024SP")],
+        )
+
+    def test_mv_to_delim(self):
+        import warnings
+
+        import numpy as np
+        import pandas as pd
+        import polars as pl
+
+        from pyhaywoodcc import mv_to_delim
+
+        df = pd.DataFrame(
+            {
+                "ID": ["01", np.nan, np.nan, "02"],
+                "Award": ["PELL", "SCH", "GRANT", "SCH"],
+                "Type": ["FED", np.nan, "STA", np.nan],
+            }
+        )
+
+        result = mv_to_delim(df, keys=["ID"], assoc={"AWARD": ["Award", "Type"]})
+        self.assertIsInstance(result, pd.DataFrame)
+        self.assertEqual(result["Award"].tolist(), ["PELL, SCH, GRANT", "SCH"])
+        self.assertEqual(result["Type"].tolist()[0], "FED, , STA")
+        self.assertTrue(pd.isna(result["Type"].tolist()[1]))
+
+        result = mv_to_delim(pl.from_pandas(df), keys=["ID"], cols=["Award", "Type"])
+        self.assertIsInstance(result, pl.DataFrame)
+        self.assertEqual(
+            result.rows(),
+            [("01", "PELL, SCH, GRANT", "FED, STA"), ("02", "SCH", None)],
+        )
+
+        # Rows before the first key still get their own values, without relying on
+        #     joins matching missing keys
+        df = pl.DataFrame(
+            {
+                "ID": [None, "01", None],
+                "Note": ["x", None, None],
+                "Award": ["A", "B", "C"],
+            }
+        )
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            result = mv_to_delim(df, keys=["ID"], cols=["Award"])
+        self.assertEqual(result.rows(), [(None, "x", "A"), ("01", None, "B, C")])
+        self.assertFalse(any("join_nulls" in str(w.message) for w in caught))
+
+    def test_delim_to_mv(self):
+        import numpy as np
+        import pandas as pd
+
+        from pyhaywoodcc import delim_to_mv, mv_to_delim
+
+        df = pd.DataFrame(
+            {
+                "ID": ["01", "02"],
+                "Award": ["PELL, SCH, GRANT", "SCH"],
+                "Type": ["FED, , STA", np.nan],
+            }
+        )
+
+        result = delim_to_mv(df, keys=["ID"], cols=["Award", "Type"], fill=False)
+        self.assertEqual(result["Award"].tolist(), ["PELL", "SCH", "GRANT", "SCH"])
+        self.assertEqual(result["ID"].isna().tolist(), [False, True, True, False])
+        self.assertTrue(pd.isna(result["Type"].tolist()[3]))
+
+        pd.testing.assert_frame_equal(
+            mv_to_delim(result, keys=["ID"], assoc={"AWARD": ["Award", "Type"]}), df
+        )
+
+        with self.assertRaises(ValueError):
+            delim_to_mv(
+                df.assign(Type=["FED", "STA"]), keys=["ID"], cols=["Award", "Type"]
+            )
+
+    def test_iter_mv_to_delim(self):
+        import pandas as pd
+
+        from pyhaywoodcc import iter_mv_to_delim, mv_to_delim
+
+        df = pd.DataFrame(
+            {
+                "ID": ["01", None, None, "02", "03", None],
+                "Award": ["PELL", "SCH", "GRANT", "SCH", "PELL", "SCH"],
+            }
+        )
+
+        chunks = list(
+            iter_mv_to_delim(
+                [df.iloc[:2], df.iloc[2:]], keys=["ID"], cols=["Award"], chunk_size=2
+            )
+        )
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks, ignore_index=True),
+            mv_to_delim(df, keys=["ID"], cols=["Award"]),
+        )
+
+    def test_duckdb_engine(self):
+        import polars as pl
+
+        from pyhaywoodcc import delim_to_mv, mv_to_delim
+
+        df = pl.DataFrame(
+            {
+                "ID": ["01", None, None, "02"],
+                "Award": ["PELL", "SCH", "GRANT", "SCH"],
+                "Type": ["FED", None, "STA", None],
+            }
+        )
+        kwargs = {"keys": ["ID"], "assoc": {"AWARD": ["Award", "Type"]}}
+
+        collapsed = mv_to_delim(df, engine="duckdb", **kwargs)
+        self.assertTrue(collapsed.equals(mv_to_delim(df, **kwargs), null_equal=True))
+
+        kwargs = {"keys": ["ID"], "cols": ["Award", "Type"], "fill": False}
+        self.assertTrue(
+            delim_to_mv(collapsed, engine="duckdb", **kwargs).equals(
+                delim_to_mv(collapsed, **kwargs), null_equal=True
+            )
+        )
+
+        with self.assertRaises(ValueError):
+            mv_to_delim(df, keys=["ID"], engine="spark")
+
+    def test_range_partitions(self):
+        import re
+
+        import duckdb
+
+        from pyhaywoodcc.ipeds import _range_partitions
+
+        ids = ["0000001", "4999999", "9999999", "12345678", "X123", None]
+        conn = duckdb.connect()
+        conn.execute("CREATE TABLE t (id VARCHAR)")
+        conn.executemany("INSERT INTO t VALUES (?)", [[i] for i in ids])
+
+        # Every ID, including missing and badly formed ones, is in exactly one partition
+        found = []
+        for partition in _range_partitions("STPR.STUDENT", 3, width=7):
+            where = re.sub(r"\[STPR\.STUDENT\]", "id", partition)
+            found += [
+                row[0] for row in conn.sql(f"SELECT id FROM t WHERE {where}").fetchall()
+            ]
+
+        self.assertEqual(sorted(found, key=str), sorted(ids, key=str))
+
+    def test_duckdb_connection(self):
+        from pyhaywoodcc import duckdb_connection
+
+        config = {"duckdb": {"threads": 2, "memory_limit": "1GB"}}
+
+        cursor = duckdb_connection(config)
+        try:
+            threads = cursor.sql("SELECT current_setting('threads')").fetchone()[0]
+            self.assertEqual(threads, 2)
+        finally:
+            cursor.close()
+
+    def test_term_calendar(self):
+        from datetime import date
+
+        import polars as pl
+
+        from pyhaywoodcc import TermCalendar
+
+        terms = pl.DataFrame(
+            {
+                "Term_ID": ["2024SP", "2023FA", "2024SU"],
+                "Semester": ["SP", "FA", "SU"],
+                "Term_Reporting_Year": [2023, 2023, 2023],
+                "Term_Index": [2, 1, 3],
+                "Term_Start_Date": [
+                    date(2024, 1, 8),
+                    date(2023, 8, 14),
+                    date(2024, 5, 20),
+                ],
+                "Term_Census_Date": [
+                    date(2024, 1, 25),
+                    date(2023, 9, 1),
+                    date(2024, 6, 3),
+                ],
+                "Term_End_Date": [
+                    date(2024, 5, 10),
+                    date(2023, 12, 15),
+                    date(2024, 7, 30),
+                ],
+            }
+        )
+        calendar = TermCalendar(terms)
+
+        self.assertEqual(
+            calendar.term_for_date([date(2023, 10, 1), date(2024, 5, 15)]).to_list(),
+            ["2023FA", None],
+        )
+        self.assertEqual(calendar.term_index(["2024SU", "1999FA"]).to_list(), [3, None])
+        self.assertEqual(
+            calendar.census_between(date(2023, 9, 1), date(2024, 6, 1)).to_list(),
+            ["2023FA", "2024SP"],
+        )
+
+        enrollment = pl.DataFrame({"Term_ID": ["2024SU", "2023FA"]}).cast(
+            {"Term_ID": calendar.dtype}
+        )
+        self.assertEqual(
+            enrollment.select(calendar.column("Semester"))["Semester"].to_list(),
+            ["SU", "FA"],
+        )
+
+        # Strings and Enums in another order are matched by value
+        def semesters(term_ids):
+            return (
+                pl.DataFrame({"Term_ID": term_ids})
+                .select(calendar.column("Semester"))["Semester"]
+                .to_list()
+            )
+
+        self.assertEqual(semesters(["2024SU", "2023FA", "1999FA"]), ["SU", "FA", None])
+        self.assertEqual(
+            semesters(
+                pl.Series(["2024SU", "2023FA", "2024SP"]).cast(
+                    pl.Enum(["2024SU", "2024SP", "2023FA"])
+                )
+            ),
+            ["SU", "FA", "SP"],
+        )
+
+    def test_reference_cache(self):
+        import polars as pl
+
+        from pyhaywoodcc.cache import ReferenceCache
+
+        df = pl.DataFrame({"Term_ID": ["2023FA", "2024SP"]})
+
+        cache = ReferenceCache(ttl=60, max_bytes=df.estimated_size() * 2)
+        cache.put(("ccdw", "", "", "Term_CU", "a"), df)
+        cache.put(("ccdw", "", "", "COURSE_SECTIONS", "b"), df)
+        self.assertIs(cache.get(("ccdw", "", "", "Term_CU", "a")), df)
+
+        # Adding a third frame evicts the least recently used one
+        cache.put(("ccdw", "", "", "ACAD_PROGRAMS", "c"), df)
+        self.assertIsNone(cache.get(("ccdw", "", "", "COURSE_SECTIONS", "b")))
+        self.assertEqual(len(cache), 2)
+
+        cache.invalidate(file="Term_CU")
+        self.assertIsNone(cache.get(("ccdw", "", "", "Term_CU", "a")))
+
+        cache.ttl = 0
+        self.assertIsNone(cache.get(("ccdw", "", "", "ACAD_PROGRAMS", "c")))
+
+    def test_extract_cache(self):
+        import tempfile
+        from types import SimpleNamespace
+        from unittest import mock
+
+        import polars as pl
+
+        from pyhaywoodcc import cache
+
+        fetched = []
+
+        def fetch():
+            fetched.append(1)
+            return pl.LazyFrame({"Person_ID": ["01", "02"]})
+
+        with tempfile.TemporaryDirectory() as cache_path:
+            conn = SimpleNamespace(
+                source="ccdw", config={"informer": {"cache_path": cache_path}}
+            )
+            watermark = {"Row_Count": "2"}
+
+            with mock.patch.object(
+                cache, "source_watermark", side_effect=lambda *a, **k: watermark
+            ):
+                df = cache.get_cached_extract(conn, "STUDENTS", fetch, cols=["ID"])
+                df = cache.get_cached_extract(conn, "STUDENTS", fetch, cols=["ID"])
+                self.assertEqual(len(fetched), 1)
+                self.assertEqual(df.collect()["Person_ID"].to_list(), ["01", "02"])
+
+                # A change in the source invalidates the cached copy
+                watermark = {"Row_Count": "3"}
+                cache.get_cached_extract(conn, "STUDENTS", fetch, cols=["ID"])
+                self.assertEqual(len(fetched), 2)
+
+    def test_source_watermark(self):
+        import warnings
+        from datetime import datetime
+        from types import SimpleNamespace
+        from unittest import mock
+
+        import polars as pl
+
+        from pyhaywoodcc import cache
+
+        calls = []
+
+        def get_data(file, **kwargs):
+            calls.append((file, kwargs))
+            return pl.DataFrame(
+                {
+                    "Term_ID": ["2023FA", "2023FA", "2024SP"],
+                    "EffectiveDatetime": [
+                        datetime(2023, 9, 1),
+                        datetime(2023, 10, 1),
+                        datetime(2024, 2, 1),
+                    ],
+                }
+            ).select(list(kwargs["cols"].values()))
+
+        conn = SimpleNamespace(
+            source="ccdw",
+            config={"sql": {"server": "sqlserver", "db": "CCDW_HIST"}},
+            get_data=get_data,
+        )
+        self.assertEqual(
+            cache._sql_uri(conn.config),
+            "mssql://sqlserver/CCDW_HIST?trusted_connection=true",
+        )
+
+        # The watermark is a single-row aggregate on the server
+        with mock.patch.object(
+            cache,
+            "_query_source",
+            return_value=pl.DataFrame(
+                {"Row_Count": [3], "Max_EffectiveDatetime": [datetime(2024, 2, 1)]}
+            ),
+        ) as query:
+            self.assertEqual(
+                cache.source_watermark(conn, "STUDENT_ACAD_CRED"),
+                {"Row_Count": "3", "Max_EffectiveDatetime": "2024-02-01 00:00:00"},
+            )
+        self.assertIn("COUNT_BIG(*)", query.call_args.args[1])
+        self.assertIn("[history].[STUDENT_ACAD_CRED_Current]", query.call_args.args[1])
+        self.assertEqual(calls, [])
+
+        # If the query fails, the watermark is read with the connection's own get_data
+        with (
+            mock.patch.object(
+                cache, "_query_source", side_effect=RuntimeError("no driver")
+            ),
+            warnings.catch_warnings(),
+        ):
+            warnings.simplefilter("ignore")
+            self.assertEqual(
+                cache.source_watermark(conn, "STUDENT_ACAD_CRED"),
+                {"Row_Count": "3", "Max_EffectiveDatetime": "2024-02-01 00:00:00"},
+            )
+        self.assertEqual(calls[0][0], "STUDENT_ACAD_CRED")
+
+        # Term watermarks are grouped by term on the server, one row per term
+        with mock.patch.object(
+            cache,
+            "_query_source",
+            return_value=pl.DataFrame(
+                {
+                    "Term_ID": ["2023FA", "2024SP"],
+                    "Row_Count": [2, 1],
+                    "Max_EffectiveDatetime": [
+                        datetime(2023, 10, 1),
+                        datetime(2024, 2, 1),
+                    ],
+                }
+            ),
+        ) as query:
+            watermarks = cache.term_watermarks(
+                conn, "STUDENT_ACAD_CRED", "STC.TERM", ["2023FA", "2024SP"]
+            )
+        self.assertEqual(watermarks["2023FA"]["Row_Count"], "2")
+        self.assertIn("GROUP BY [STC.TERM]", query.call_args.args[1])
+        self.assertIn("IN ('2023FA','2024SP')", query.call_args.args[1])
+
+        # ...and grouped here from get_data if the query fails
+        with (
+            mock.patch.object(
+                cache, "_query_source", side_effect=RuntimeError("no driver")
+            ),
+            warnings.catch_warnings(),
+        ):
+            warnings.simplefilter("ignore")
+            self.assertEqual(
+                cache.term_watermarks(
+                    conn, "STUDENT_ACAD_CRED", "STC.TERM", ["2023FA", "2024SP"]
+                ),
+                watermarks,
+            )
+        self.assertIn("[STC.TERM] IN ['2023FA','2024SP']", calls[1][1]["where"])
+
+    def test_incremental_term_enrollment(self):
+        import tempfile
+        from unittest import mock
+
+        import polars as pl
+
+        from pyhaywoodcc import ipeds
+
+        tables = _colleague_tables()
+        versions = {term_id: 1 for term_id in tables["Term_CU"]["Term_ID"]}
+
+        def watermarks(conn, file, term_column, term_ids, **kwargs):
+            return {term_id: versions[term_id] for term_id in term_ids}
+
+        with (
+            tempfile.TemporaryDirectory() as cache_path,
+            _fake_colleague(
+                tables, config={"informer": {"cache_path": cache_path}}
+            ) as conn,
+            mock.patch.object(ipeds, "term_watermarks", side_effect=watermarks),
+            mock.patch.object(
+                ipeds, "_term_enrollment", wraps=ipeds._term_enrollment
+            ) as compute,
+        ):
+
+            def recomputed():
+                return [
+                    sorted(c.args[2].collect()["Term_ID"].to_list())
+                    for c in compute.call_args_list
+                ]
+
+            def enrollment(incremental):
+                return ipeds.term_enrollment(conn, incremental=incremental).sort(
+                    ["Person_ID", "Term_ID"]
+                )
+
+            first = enrollment(True)
+            self.assertEqual(recomputed(), [sorted(versions)])
+            self.assertGreater(first.height, 0)
+
+            # Nothing has changed, so every term comes from the stored slices
+            compute.reset_mock()
+            self.assertTrue(enrollment(True).equals(first))
+            self.assertEqual(recomputed(), [])
+
+            # Drop one student's 2020SP courses and mark only that term as changed
+            tables["STUDENT_ACAD_CRED"] = tables["STUDENT_ACAD_CRED"].filter(
+                ~(
+                    (pl.col("STC.PERSON.ID") == "0000001")
+                    & (pl.col("STC.TERM") == "2020SP")
+                )
+            )
+            versions["2020SP"] = 2
+
+            compute.reset_mock()
+            second = enrollment(True)
+            self.assertEqual(recomputed(), [["2020SP"]])
+            self.assertFalse(second.equals(first))
+
+            compute.reset_mock()
+            self.assertTrue(second.equals(enrollment(False)))
+
+    def test_iter_reports(self):
+        import polars as pl
+
+        from pyhaywoodcc import ipeds
+
+        keys = ["Person_ID", "Term_ID"]
+        with _fake_colleague() as conn:
+            for iter_report, report in [
+                (ipeds.iter_term_enrollment, ipeds.term_enrollment),
+                (ipeds.iter_credential_seekers, ipeds.credential_seekers),
+            ]:
+                expected = report(conn).sort(keys)
+                self.assertGreater(expected.height, 0)
+
+                for by, pieces in [("year", 2), ("term", 4)]:
+                    chunks = list(iter_report(conn, by=by))
+                    self.assertEqual(len(chunks), pieces)
+                    self.assertTrue(pl.concat(chunks).sort(keys).equals(expected))
+
+    def test_credential_seekers_exclude_hs(self):
+        import polars as pl
+
+        from pyhaywoodcc import ipeds
+
+        keys = ["Person_ID", "Term_ID"]
+        with _fake_colleague() as conn:
+            seekers = ipeds.credential_seekers(conn)
+            excluded = ipeds.credential_seekers(conn, exclude_hs=True)
+
+            # Student 0000003 is a high school student until the end of June 2020
+            self.assertEqual(
+                sorted(set(seekers.rows()) - set(excluded.rows())),
+                [
+                    ("0000003", "2019FA", 1),
+                    ("0000003", "2020SP", 1),
+                    ("0000003", "2020SU", 1),
+                ],
+            )
+            self.assertTrue(set(excluded.rows()) <= set(seekers.rows()))
+
+            streamed = pl.concat(
+                list(ipeds.iter_credential_seekers(conn, exclude_hs=True))
+            )
+            self.assertTrue(streamed.sort(keys).equals(excluded.sort(keys)))
+
+    def test_output_dtypes(self):
+        import polars as pl
+
+        from pyhaywoodcc import ipeds
+
+        with _fake_colleague() as conn:
+
+            enrollment = ipeds.term_enrollment(conn, report_years=2020)
+            self.assertGreater(enrollment.height, 0)
+            self.assertEqual(
+                dict(enrollment.schema),
+                {
+                    "Person_ID": pl.Utf8,
+                    "Term_ID": pl.Utf8,
+                    "Term_Reporting_Year": pl.Int64,
+                    "Semester": pl.Utf8,
+                    "Credits": pl.Int32,
+                    "Status": pl.Utf8,
+                    "Distance_Courses": pl.Utf8,
+                    "Enrollment_Status": pl.Utf8,
+                },
+            )
+
+            seekers = ipeds.credential_seekers(conn, report_years=2020)
+            self.assertEqual(
+                dict(seekers.schema),
+                {
+                    "Person_ID": pl.Utf8,
+                    "Term_ID": pl.Utf8,
+                    "Credential_Seeker": pl.Int32,
+                },
+            )
+
+            # pandas callers get plain object and integer columns
+            conn.df_format = "pandas"
+            enrollment = ipeds.term_enrollment(conn, report_years=2020)
+            self.assertEqual(str(enrollment["Term_ID"].dtype), "object")
+            self.assertEqual(str(enrollment["Credits"].dtype), "int32")
+
+    def test_term_enrollment_tied_versions(self):
+        import polars as pl
+
+        from pyhaywoodcc import ipeds
+
+        tables = _colleague_tables()
+        with _fake_colleague(tables) as conn:
+            expected = ipeds.term_enrollment(conn).sort(["Person_ID", "Term_ID"])
+
+            # A second version of a course at the same time, differing only in the grade,
+            #     is still one course
+            sac = tables["STUDENT_ACAD_CRED"]
+            tables["STUDENT_ACAD_CRED"] = pl.concat(
+                [sac, sac.head(1).with_columns(pl.lit("B").alias("STC.VERIFIED.GRADE"))]
+            )
+            actual = ipeds.term_enrollment(conn).sort(["Person_ID", "Term_ID"])
+
+            self.assertTrue(actual.equals(expected))
+
+    def test_ipeds_cohort_student_terms(self):
+        from pyhaywoodcc import ipeds
+
+        with _fake_colleague() as conn:
+
+            cohort = ipeds.ipeds_cohort(conn, report_years=2019, use="STUDENT_TERMS")
+            self.assertEqual(cohort.rows(), [("0000001", "2019FA", "FT")])
+
+            cohort = ipeds.ipeds_cohort(
+                conn,
+                report_years=2020,
+                cohorts=["PT"],
+                cohort_types=["Cohort", "OM_Cohort"],
+                use="STUDENT_TERMS",
+            )
+            self.assertEqual(cohort.rows(), [("0000003", "2020FA", "PT", None)])
+
+    def test_ipeds_bundle(self):
+        from unittest import mock
+
+        from pyhaywoodcc import ipeds
+
+        with _fake_colleague() as conn:
+
+            # The terms are read once for all three results
+            with mock.patch.object(
+                ipeds, "get_terms", wraps=ipeds.get_terms
+            ) as get_terms:
+                bundle = ipeds.ipeds_bundle(
+                    conn, report_years=2019, report_semesters=["FA", "SP"]
+                )
+                self.assertEqual(get_terms.call_count, 1)
+
+            expected = {
+                "term_enrollment": ipeds.term_enrollment(
+                    conn, report_years=2019, report_semesters=["FA", "SP"]
+                ),
+                "credential_seekers": ipeds.credential_seekers(
+                    conn, report_years=2019, report_semesters=["FA", "SP"]
+                ),
+                "ipeds_cohort": ipeds.ipeds_cohort(conn, report_years=2019),
+            }
+
+            self.assertEqual(sorted(bundle), sorted(expected))
+            for name, df in expected.items():
+                self.assertGreater(df.height, 0)
+                self.assertTrue(
+                    bundle[name]
+                    .sort(["Person_ID", "Term_ID"])
+                    .equals(df.sort(["Person_ID", "Term_ID"])),
+                    name,
+                )
+
+    def test_cohort_outcomes(self):
+        import polars as pl
+
+        from pyhaywoodcc import ipeds
+
+        with _fake_colleague() as conn:
+
+            # The 2019FA TF student and the 2020FA cohort are left out
+            outcomes = ipeds.cohort_outcomes(
+                conn, 2019, horizon_terms=3, cohorts=["FT", "PT"]
+            )
+            students = outcomes["students"]
+            self.assertEqual(
+                sorted(set(students.select(["Person_ID", "Cohort"]).rows())),
+                [("0000001", "FT"), ("0000002", "PT")],
+            )
+            self.assertEqual(
+                students.filter(pl.col("Person_ID") == "0000001")["Enrolled"].to_list(),
+                [True, True, False, True],
+            )
+
+            retention = outcomes["retention"].filter(pl.col("Cohort") == "PT")
+            self.assertEqual(
+                retention["Term_ID"].to_list(), ["2019FA", "2020SP", "2020SU", "2020FA"]
+            )
+            self.assertEqual(retention["Cohort_Size"].to_list(), [1, 1, 1, 1])
+            self.assertEqual(retention["Enrolled"].to_list(), [1, 0, 0, 1])
+
+    def test_ipeds_cohort_prefer(self):
+        import os
+        import tempfile
+
+        import polars as pl
+
+        from pyhaywoodcc import ipeds
+
+        tables = _colleague_tables()
+        tables["ipeds_cohorts"] = pl.concat(
+            [tables["ipeds_cohorts"], tables["ipeds_cohorts"].head(1)]
+        )
+        with (
+            tempfile.TemporaryDirectory() as ipeds_path,
+            _fake_colleague(tables) as conn,
+        ):
+            with open(os.path.join(ipeds_path, "ipeds_cohorts.csv"), "w") as f:
+                f.write(
+                    "Person_ID,Term_ID,Cohort\n"
+                    "0000001,2019FA,PT\n"
+                    "0000002,2019FA,TF\n"
+                    "0000002,2019FA,TF\n"
+                    "0000006,2019FA,FT\n"
+                )
+
+            def cohort(prefer):
+                return ipeds.ipeds_cohort(
+                    conn,
+                    report_years=2019,
+                    ipeds_path=ipeds_path,
+                    useonly=False,
+                    prefer=prefer,
+                ).sort("Person_ID")
+
+            # Duplicates within either source come through once
+            self.assertEqual(
+                cohort("file").rows(),
+                [
+                    ("0000001", "2019FA", "PT"),
+                    ("0000002", "2019FA", "TF"),
+                    ("0000003", "2019FA", "TF"),
+                    ("0000006", "2019FA", "FT"),
+                ],
+            )
+            self.assertEqual(
+                cohort("database").rows(),
+                [
+                    ("0000001", "2019FA", "FT"),
+                    ("0000002", "2019FA", "PT"),
+                    ("0000003", "2019FA", "TF"),
+                    ("0000006", "2019FA", "FT"),
+                ],
+            )
+
+            # ipeds_bundle passes prefer through to the cohorts
+            for prefer in ["file", "database"]:
+                bundle = ipeds.ipeds_bundle(
+                    conn,
+                    report_years=2019,
+                    ipeds_path=ipeds_path,
+                    useonly=False,
+                    prefer=prefer,
+                )
+                self.assertEqual(
+                    bundle["ipeds_cohort"].sort("Person_ID").rows(),
+                    cohort(prefer).rows(),
+                )
+
+    def test_csv_sidecar(self):
+        import os
+        import tempfile
+
+        import polars as pl
+
+        from pyhaywoodcc import cache
+
+        with tempfile.TemporaryDirectory() as ipeds_path:
+            csv_fn = os.path.join(ipeds_path, "ipeds_cohorts.csv")
+            with open(csv_fn, "w") as f:
+                f.write("Person_ID,Term_ID,Cohort\n0012345,2023FA,FT\n")
+
+            sidecar_fn = cache.csv_sidecar(csv_fn)
+            df = pl.read_parquet(sidecar_fn)
+            self.assertEqual(df["Person_ID"].to_list(), ["0012345"])
+
+            # The copy is reused until the CSV changes
+            built = os.stat(sidecar_fn).st_mtime_ns
+            self.assertEqual(cache.csv_sidecar(csv_fn), sidecar_fn)
+            self.assertEqual(os.stat(sidecar_fn).st_mtime_ns, built)
+
+            with open(csv_fn, "a") as f:
+                f.write("0067890,2023FA,PT\n")
+
+            df = pl.read_parquet(cache.csv_sidecar(csv_fn))
+            self.assertEqual(df["Cohort"].to_list(), ["FT", "PT"])
+
     # def test_version(self):
     #     import pyhaywoodcc
     #     self.assertTrue(hasattr(pyhaywoodcc, '__version__'))